@@ -41,7 +41,27 @@ class CustomLogger:
             self.logger._log(level, msg, args=(), **kwargs)
 
 
-from .logmod import logs  # noqa E402
+from .logmod import logs, stop_logs, log_context  # noqa E402
 from . import common  # noqa E402
 from . import settings  # noqa E402
-from . import analysis  # noqa E402
+from . import config  # noqa E402
+from .config import Config, ConfigError, get_config  # noqa E402
+
+# submodules with heavy dependencies, imported on first access
+_lazy_submodules = ('analysis', 'benchmark', 'standin')
+
+
+def __getattr__(name):
+    """Import submodules with heavy dependencies on first access (PEP 562),
+    so that importing gptevents in worker processes and scripts stays fast.
+    """
+    if name in _lazy_submodules:
+        import importlib
+        module = importlib.import_module('.' + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_submodules))
@@ -1,2 +1,24 @@
-from .analysis import Analysis  # noqa
-from .chatgpt import ChatGPT  # noqa
+# classes are imported from their modules on first access, so that e.g. worker
+# processes rasterising pages do not import matplotlib, plotly and openai
+_lazy_attributes = {'Analysis': 'analysis',
+                    'ChatGPT': 'chatgpt',
+                    'RasterEngine': 'raster',
+                    'PageEncoder': 'encoder',
+                    'PagePreprocessor': 'preprocess',
+                    'Metrics': 'metrics',
+                    'WorkQueue': 'workqueue',
+                    'ParquetStore': 'store'}
+
+
+def __getattr__(name):
+    """Import classes from their modules on first access (PEP 562)."""
+    if name in _lazy_attributes:
+        import importlib
+        value = getattr(importlib.import_module('.' + _lazy_attributes[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_attributes))
@@ -1,7 +1,11 @@
 # by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com>
 import os
+import gzip
+import html
 import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 import plotly as py
 import plotly.graph_objs as go
 import plotly.express as px
@@ -15,8 +19,8 @@ logger = gpte.CustomLogger(__name__)  # use custom logger
 
 
 class Analysis:
-    # set template for plotly output
-    template = gpte.common.get_configs('plotly_template')
+    # set template for plotly output, read from config on first use
+    template = gpte.common.LazyConfig('plotly_template')
     # folder for output
     fig = None
     g = None
@@ -26,10 +30,31 @@ class Analysis:
     save_frames = False
     folder = '/figures/'
     polygons = None
+    # output of plotly figures: 'inline' for html files with plotly.js each,
+    # 'shared' for html files referencing one plotly.js file in the folder and
+    # 'dashboard' for one html file with all figures written by save_dashboard
+    plotly_output = 'inline'
+    auto_open = False  # open html files in browser
+    compress = False  # save dashboard as gzipped html file
+    file_dashboard = 'dashboard'  # name of dashboard file without extension
 
-    def __init__(self):
+    def __init__(self, plotly_output='inline', auto_open=False, compress=False):
         # set font to Times
         plt.rc('font', family='serif')
+        if plotly_output not in ('inline', 'shared', 'dashboard'):
+            raise ValueError('Unknown output of plotly figures {}.'.format(plotly_output))
+        # output of plotly figures
+        self.plotly_output = plotly_output
+        # open html files in browser, off for headless runs
+        self.auto_open = auto_open
+        # save dashboard as gzipped html file
+        self.compress = compress
+        # figures collected for dashboard as tuples of name and figure
+        self.dashboard = []
+        # prettified labels keyed by original text labels, shared by all plots
+        self.labels = {}
+        # prettified columns keyed by names, with copies of the columns they were prepared from
+        self.columns = {}
 
     def bar(self, df, y: list, x=None, stacked=False, pretty_text=False,
             orientation='v', xaxis_title=None, yaxis_title=None,
@@ -61,13 +86,7 @@ class Analysis:
         logger.info('Creating bar chart for x={} and y={}', x, y)
         # prettify text
         if pretty_text:
-            for variable in y:
-                # check if column contains strings
-                if isinstance(df.iloc[0][variable], str):
-                    # replace underscores with spaces
-                    df[variable] = df[variable].str.replace('_', ' ')
-                    # capitalise
-                    df[variable] = df[variable].str.capitalize()
+            df = self.plot_frame(df, pretty=y)
         # use index of df if no is given
         if not x:
             x = df.index
@@ -184,35 +203,7 @@ class Analysis:
             return -1
         # prettify text
         if pretty_text:
-            if isinstance(df.iloc[0][x], str):  # check if string
-                # replace underscores with spaces
-                df[x] = df[x].str.replace('_', ' ')
-                # capitalise
-                df[x] = df[x].str.capitalize()
-            if isinstance(df.iloc[0][y], str):  # check if string
-                # replace underscores with spaces
-                df[y] = df[y].str.replace('_', ' ')
-                # capitalise
-                df[y] = df[y].str.capitalize()
-            if color and isinstance(df.iloc[0][color], str):  # check if string
-                # replace underscores with spaces
-                df[color] = df[color].str.replace('_', ' ')
-                # capitalise
-                df[color] = df[color].str.capitalize()
-            if size and isinstance(df.iloc[0][size], str):  # check if string
-                # replace underscores with spaces
-                df[size] = df[size].str.replace('_', ' ')
-                # capitalise
-                df[size] = df[size].str.capitalize()
-            try:
-                # check if string
-                if text and isinstance(df.iloc[0][text], str):
-                    # replace underscores with spaces
-                    df[text] = df[text].str.replace('_', ' ')
-                    # capitalise
-                    df[text] = df[text].str.capitalize()
-            except ValueError as e:
-                logger.debug('Tried to prettify {} with exception {}', text, e)
+            df = self.plot_frame(df, pretty=[x, y, color, size, text], columns=[symbol] + list(hover_data or []))
         # scatter plot with histograms
         with warnings.catch_warnings():
             warnings.simplefilter('ignore', category=RuntimeWarning)
@@ -272,18 +263,7 @@ class Analysis:
             return -1
         # prettify ticks
         if pretty_text:
-            for variable in x:
-                # check if column contains strings
-                if isinstance(df.iloc[0][variable], str):
-                    # replace underscores with spaces
-                    df[variable] = df[variable].str.replace('_', ' ')
-                    # capitalise
-                    df[variable] = df[variable].str.capitalize()
-            if color and isinstance(df.iloc[0][color], str):  # check if string
-                # replace underscores with spaces
-                df[color] = df[color].str.replace('_', ' ')
-                # capitalise
-                df[color] = df[color].str.capitalize()
+            df = self.plot_frame(df, pretty=list(x) + [color])
         # create figure
         if color:
             fig = px.histogram(df[x], nbins=nbins, marginal=marginal,
@@ -330,6 +310,85 @@ class Analysis:
         else:
             fig.show()
 
+    def plot_frame(self, df, pretty, columns=()):
+        """
+        Return dataframe with the columns needed for a plot, with labels in
+        text columns prettified by replacing _ with spaces and capitalising.
+        The input dataframe is not changed.
+
+        Args:
+            df (dataframe): dataframe with data.
+            pretty (list): columns with labels to prettify. None is skipped.
+            columns (list, optional): other columns needed for the plot.
+
+        Returns:
+            dataframe: dataframe with columns for the plot.
+        """
+        frame = {column: df[column] for column in columns if column is not None}
+        for column in pretty:
+            if column is not None:
+                frame[column] = self.pretty_column(df[column])
+        return pd.DataFrame(frame, index=df.index, copy=False)
+
+    def pretty_column(self, series):
+        """
+        Prettify labels in a text column. Columns are recognised as text by
+        their dtype. Each unique text label is prettified once and kept for
+        later plots, and values are mapped to prettified labels through codes
+        of the column as categorical. Prettified columns are kept as well and
+        reused while the column has the same values, so that later plots of
+        the same column only compare it with the kept copy.
+
+        Args:
+            series (series): column of dataframe.
+
+        Returns:
+            series: column with prettified labels or the column unchanged if
+                    it does not contain text.
+        """
+        # only object, string and categorical columns may contain labels
+        if not (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)
+                or isinstance(series.dtype, pd.CategoricalDtype)):
+            return series
+        # reuse column prepared for an earlier plot if values did not change
+        cached = self.columns.get(series.name)
+        if cached is not None and cached[0].equals(series):
+            return cached[1]
+        try:
+            categorical = series.astype('category')
+        except TypeError:
+            # unhashable values like lists are not labels
+            return series
+        # prettify only text labels not seen in earlier plots, other values are kept as they are
+        labels = []
+        for label in categorical.cat.categories:
+            if not isinstance(label, str):
+                labels.append(label)
+                continue
+            if label not in self.labels:
+                self.labels[label] = self.pretty_label(label)
+            labels.append(self.labels[label])
+        # look up prettified labels by codes of categories, missing values have code -1
+        labels = np.array(labels + [np.nan], dtype=object)
+        pretty = pd.Series(labels[categorical.cat.codes.to_numpy()], index=series.index, name=series.name)
+        self.columns[series.name] = (series.copy(), pretty)
+        return pretty
+
+    @staticmethod
+    def pretty_label(label):
+        """
+        Prettify label by replacing _ with spaces and capitalising it.
+
+        Args:
+            label: label, values other than strings are returned unchanged.
+
+        Returns:
+            prettified label.
+        """
+        if not isinstance(label, str):
+            return label
+        return label.replace('_', ' ').capitalize()
+
     def save_plotly(self, fig, name, output_subdir):
         """
         Helper function to save figure as html file.
@@ -339,6 +398,10 @@ class Analysis:
             name (str): name of html file.
             output_subdir (str): Folder for saving file.
         """
+        # figures for dashboard are written at once by save_dashboard
+        if self.plotly_output == 'dashboard':
+            self.dashboard.append((name, fig))
+            return
         # build path
         path = gpte.settings.output_dir + output_subdir
         if not os.path.exists(path):
@@ -347,8 +410,50 @@ class Analysis:
         if len(path) + len(name) > 250:
             name = name[:255 - len(path) - 5]
         file_plot = os.path.join(path + name + '.html')
+        # save to file, plotly.js is copied to the folder once for shared output
+        fig.write_html(file_plot,
+                       include_plotlyjs='directory' if self.plotly_output == 'shared' else True,
+                       auto_open=self.auto_open)
+
+    def save_dashboard(self, output_subdir=None):
+        """
+        Save figures collected in dashboard output as one html file with
+        plotly.js included once, gzipped if compress is set.
+
+        Args:
+            output_subdir (str, optional): Folder for saving file. Defaults to
+                                           folder for figures.
+
+        Returns:
+            str: path of file or None if no figures were collected.
+        """
+        if not self.dashboard:
+            return None
+        # build path
+        path = gpte.settings.output_dir + (output_subdir or self.folder)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # links to figures on top of page
+        links = ''.join('<li><a href="#fig-{}">{}</a></li>'.format(i, html.escape(name))
+                        for i, (name, _) in enumerate(self.dashboard))
+        # figures without plotly.js, which is included once in head of page
+        figures = ''.join('<h2 id="fig-{}">{}</h2>{}'.format(i, html.escape(name),
+                                                             fig.to_html(full_html=False, include_plotlyjs=False))
+                          for i, (name, fig) in enumerate(self.dashboard))
+        page = ('<html><head><meta charset="utf-8"><script type="text/javascript">{}</script></head>'
+                '<body><ul>{}</ul>{}</body></html>').format(py.offline.get_plotlyjs(), links, figures)
         # save to file
-        py.offline.plot(fig, filename=file_plot)
+        file_plot = os.path.join(path + self.file_dashboard + '.html')
+        if self.compress:
+            file_plot += '.gz'
+            with gzip.open(file_plot, 'wt', encoding='utf-8') as f:
+                f.write(page)
+        else:
+            with open(file_plot, 'w', encoding='utf-8') as f:
+                f.write(page)
+        logger.info('Saved dashboard with {} figures to {}.', len(self.dashboard), file_plot)
+        self.dashboard = []
+        return file_plot
 
     def save_fig(self, image, fig, output_subdir, suffix, pad_inches=0):
         """
@@ -0,0 +1,212 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import os
+import json
+import time
+import openai
+
+import gptevents as gpte
+from .ratelimit import RateLimiter, is_retryable
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+class BatchRunner:
+    """Run requests to GPT4-V as asynchronous batch jobs: requests are
+    serialised to JSONL files, uploaded and submitted as batches, polled
+    until completion and their results are read back. Calls to the server
+    are retried with backoff of the rate limiter, and ids of batches are kept
+    until their results are collected, so that an interrupted run collects
+    them instead of submitting the requests again. Works with any server
+    implementing the files and batches endpoints of OpenAI.
+    """
+    # endpoint of requests in batch
+    endpoint = '/v1/chat/completions'
+    # time within which batch is processed
+    completion_window = '24h'
+    # maximum number of requests in one batch file
+    max_requests = 50000
+    # maximum size of one batch file in bytes
+    max_bytes = 190 * 1024 ** 2
+    # statuses of finished batches
+    final_statuses = ('completed', 'failed', 'expired', 'cancelled')
+    # file with ids of submitted batches
+    file_batches = 'batches.json'
+
+    def __init__(self, client, path, poll_interval=60.0, timeout=None, limiter=None):
+        # client for communicating with GPT4-V
+        self.client = client
+        # backoff of calls to the server that failed with transient errors
+        self.limiter = limiter or RateLimiter()
+        # folder for request files and ids of batches
+        self.path = path
+        # time between checks of status of batches in seconds
+        self.poll_interval = poll_interval
+        # maximum time to wait for batches in seconds
+        self.timeout = timeout
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def write(self, requests):
+        """Serialise requests to JSONL files, starting a new file when limits
+        of one batch are reached.
+        Args:
+            requests (iterable): pairs of custom id and body of request.
+
+        Returns:
+            list: paths of request files.
+        """
+        paths = []
+        f = None
+        n_requests = n_bytes = 0
+        try:
+            for custom_id, body in requests:
+                line = (json.dumps({'custom_id': custom_id,
+                                    'method': 'POST',
+                                    'url': self.endpoint,
+                                    'body': body}) + '\n').encode('utf-8')
+                # start new file
+                if f is None or n_requests >= self.max_requests or n_bytes + len(line) > self.max_bytes:
+                    if f is not None:
+                        f.close()
+                    paths.append(os.path.join(self.path, 'requests_{}.jsonl'.format(len(paths) + 1)))
+                    f = open(paths[-1], 'wb')
+                    n_requests = n_bytes = 0
+                f.write(line)
+                n_requests += 1
+                n_bytes += len(line)
+        finally:
+            if f is not None:
+                f.close()
+        logger.info('Wrote requests to {} batch files.', len(paths))
+        return paths
+
+    def call(self, method, *args, **kwargs):
+        """Call method of client, retrying transient errors with backoff.
+        Args:
+            method (callable): method of client.
+            *args: arguments of method.
+            **kwargs: keyword arguments of method.
+
+        Returns:
+            object: result of method.
+        """
+        for attempt in range(self.limiter.max_retries + 1):
+            try:
+                return method(*args, **kwargs)
+            except openai.APIError as e:
+                if not is_retryable(e) or attempt >= self.limiter.max_retries:
+                    raise
+                delay = self.limiter.backoff(attempt, e)
+                logger.warning('{} in call to batch API. Retrying in {:.1f} s (attempt {} of {}).',
+                               type(e).__name__, delay, attempt + 1, self.limiter.max_retries)
+                time.sleep(delay)
+
+    def upload(self, path):
+        """Upload request file.
+        Args:
+            path (str): path of request file.
+
+        Returns:
+            FileObject: uploaded file.
+        """
+        with open(path, 'rb') as f:
+            return self.client.files.create(file=f, purpose='batch')
+
+    def submit(self, paths):
+        """Upload request files and submit them as batches.
+        Args:
+            paths (list): paths of request files.
+
+        Returns:
+            list: ids of batches.
+        """
+        batch_ids = []
+        for path in paths:
+            input_file = self.call(self.upload, path)
+            batch = self.call(self.client.batches.create,
+                              input_file_id=input_file.id,
+                              endpoint=self.endpoint,
+                              completion_window=self.completion_window)
+            logger.info('Submitted batch {} with requests from {}.', batch.id, path)
+            batch_ids.append(batch.id)
+            # store ids to be able to collect results of batches later
+            self.store(self.submitted() + [batch.id])
+        return batch_ids
+
+    def store(self, batch_ids):
+        """Store ids of batches that are not collected yet.
+        Args:
+            batch_ids (list): ids of batches.
+        """
+        with open(os.path.join(self.path, self.file_batches), 'w') as f:
+            json.dump(batch_ids, f)
+
+    def forget(self, batch_ids):
+        """Remove ids of collected batches from stored ids.
+        Args:
+            batch_ids (list): ids of batches.
+        """
+        self.store([batch_id for batch_id in self.submitted() if batch_id not in batch_ids])
+
+    def submitted(self):
+        """Return ids of batches submitted before and not collected yet.
+
+        Returns:
+            list: ids of batches.
+        """
+        try:
+            with open(os.path.join(self.path, self.file_batches)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def wait(self, batch_ids):
+        """Poll batches until all of them are finished.
+        Args:
+            batch_ids (list): ids of batches.
+
+        Returns:
+            list: finished batches.
+        """
+        start = time.monotonic()
+        batches = {}
+        while True:
+            for batch_id in batch_ids:
+                if batch_id not in batches:
+                    batch = self.call(self.client.batches.retrieve, batch_id)
+                    if batch.status in self.final_statuses:
+                        logger.info('Batch {} finished with status {}.', batch_id, batch.status)
+                        batches[batch_id] = batch
+            if len(batches) == len(batch_ids):
+                return [batches[batch_id] for batch_id in batch_ids]
+            if self.timeout is not None and time.monotonic() - start > self.timeout:
+                raise TimeoutError('Batches {} did not finish within {} s.'.format(
+                    [batch_id for batch_id in batch_ids if batch_id not in batches], self.timeout))
+            logger.debug('Waiting for {} batches.', len(batch_ids) - len(batches))
+            time.sleep(self.poll_interval)
+
+    def results(self, batches):
+        """Read results of finished batches.
+        Args:
+            batches (list): finished batches.
+
+        Yields:
+            tuple: custom id, content of response, which is None if it has no
+                   content, and error or None if the request succeeded.
+        """
+        for batch in batches:
+            if batch.status != 'completed':
+                logger.error('Batch {} has status {}.', batch.id, batch.status)
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if not file_id:
+                    continue
+                for line in self.call(self.client.files.content, file_id).text.splitlines():
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    response = result.get('response') or {}
+                    if result.get('error') or response.get('status_code') != 200:
+                        yield (result['custom_id'], None, result.get('error') or response.get('body')
+                               or 'status code {}'.format(response.get('status_code')))
+                    else:
+                        yield result['custom_id'], response['body']['choices'][0]['message']['content'], None
@@ -0,0 +1,290 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from contextlib import closing
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Return sha256 hash of the content of a file.
+    Args:
+        path (str): Path of file.
+        chunk_size (int, optional): Size of chunks read from disk.
+
+    Returns:
+        str: hex digest of the content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """On-disk cache of responses from GPT4-V stored in SQLite. Entries are
+    addressed by a hash of everything that determines the response: content
+    of the report, query, model and parameters of the images.
+    """
+    # name of database in cache folder
+    file_db = 'responses.sqlite'
+
+    def __init__(self, path=None, max_age=None, max_size=None):
+        # path of database
+        if path is None:
+            path = os.path.join(gpte.settings.cache_dir, self.file_db)
+        self.path = path
+        # maximum age of entries in seconds
+        self.max_age = max_age
+        # maximum total size of responses in bytes
+        self.max_size = max_size
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        with self._connect() as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, '
+                         'created REAL NOT NULL, accessed REAL NOT NULL, meta TEXT)')
+            # add column for metadata to databases created before it existed
+            if 'meta' not in [row[1] for row in conn.execute('PRAGMA table_info(responses)')]:
+                conn.execute('ALTER TABLE responses ADD COLUMN meta TEXT')
+
+    def _connect(self):
+        """Open connection to database. Connections are not shared so that the
+        cache can be used from several threads and processes.
+        """
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    @staticmethod
+    def make_key(**parts):
+        """Return key for an entry from the parts that determine the response.
+        Args:
+            parts: values describing the request, e.g. hash of report and query.
+
+        Returns:
+            str: key of entry.
+        """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return cached response or None if there is no entry for the key.
+        Args:
+            key (str): key of entry.
+
+        Returns:
+            str: response.
+        """
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key):
+        """Return cached response with its metadata or None if there is no
+        entry for the key.
+        Args:
+            key (str): key of entry.
+
+        Returns:
+            tuple: response and dictionary with metadata.
+        """
+        with self._connect() as conn, conn:
+            row = conn.execute('SELECT response, created, meta FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            # expired entry
+            if self.max_age is not None and time.time() - row[1] > self.max_age:
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        return row[0], json.loads(row[2]) if row[2] else {}
+
+    def put(self, key, response, meta=None):
+        """Store response in the cache.
+        Args:
+            key (str): key of entry.
+            response (str): response.
+            meta (dict, optional): metadata stored with response.
+        """
+        now = time.time()
+        with self._connect() as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO responses (key, response, size, created, accessed, meta) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, response, len(response.encode('utf-8')), now, now,
+                          json.dumps(meta) if meta else None))
+
+    def evict(self, max_age=None, max_size=None):
+        """Remove entries older than max_age seconds and least recently used
+        entries until total size of responses is at most max_size bytes.
+        Args:
+            max_age (float, optional): maximum age of entries in seconds.
+                                       Defaults to max_age of the cache.
+            max_size (int, optional): maximum total size in bytes. Defaults to
+                                      max_size of the cache.
+
+        Returns:
+            int: number of removed entries.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        max_size = self.max_size if max_size is None else max_size
+        removed = 0
+        with self._connect() as conn, conn:
+            if max_age is not None:
+                removed += conn.execute('DELETE FROM responses WHERE created < ?',
+                                        (time.time() - max_age,)).rowcount
+            if max_size is not None:
+                total = 0
+                stale = []
+                for key, size in conn.execute('SELECT key, size FROM responses ORDER BY accessed DESC'):
+                    total += size
+                    if total > max_size:
+                        stale.append((key,))
+                conn.executemany('DELETE FROM responses WHERE key = ?', stale)
+                removed += len(stale)
+        if removed:
+            logger.info('Evicted {} responses from cache.', removed)
+        return removed
+
+    def clear(self):
+        """Remove all entries."""
+        with self._connect() as conn, conn:
+            conn.execute('DELETE FROM responses')
+
+
+class PageCache:
+    """On-disk cache of rasterised pages of reports stored in SQLite. Pages
+    are addressed by hash of the report, number of page and parameters of
+    rendering (DPI, resize dimensions and output format). Least recently
+    used reports are evicted when total size exceeds max_size.
+    """
+    # name of database in cache folder
+    file_db = 'pages.sqlite'
+
+    def __init__(self, path=None, max_size=None):
+        # path of database
+        if path is None:
+            path = os.path.join(gpte.settings.cache_dir, self.file_db)
+        self.path = path
+        # maximum total size of pages in bytes
+        self.max_size = max_size
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        with self._connect() as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS reports ('
+                         'key TEXT PRIMARY KEY, report TEXT NOT NULL, n_pages INTEGER NOT NULL, '
+                         'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS pages ('
+                         'key TEXT NOT NULL, page INTEGER NOT NULL, data BLOB NOT NULL, '
+                         'PRIMARY KEY (key, page))')
+
+    def _connect(self):
+        """Open connection to database."""
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    @staticmethod
+    def make_key(report, **params):
+        """Return key for pages of a report rendered with given parameters.
+        Args:
+            report (str): hash of the report.
+            params: parameters of rendering, e.g. dpi, resize_dimentions and fmt.
+
+        Returns:
+            str: key of entry.
+        """
+        return ResponseCache.make_key(report=report, **params)
+
+    def contains(self, key):
+        """Check if all pages for the key are in the cache.
+        Args:
+            key (str): key of entry.
+
+        Returns:
+            bool: pages are cached.
+        """
+        with self._connect() as conn:
+            return conn.execute('SELECT 1 FROM reports WHERE key = ?', (key,)).fetchone() is not None
+
+    def get(self, key):
+        """Return cached pages or None if pages for the key are not cached.
+        Args:
+            key (str): key of entry.
+
+        Returns:
+            list: pages as encoded images in the order of pages.
+        """
+        with self._connect() as conn, conn:
+            row = conn.execute('SELECT n_pages FROM reports WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            pages = [data for data, in conn.execute('SELECT data FROM pages WHERE key = ? ORDER BY page', (key,))]
+            # incomplete entry
+            if len(pages) != row[0]:
+                return None
+            conn.execute('UPDATE reports SET accessed = ? WHERE key = ?', (time.time(), key))
+        return pages
+
+    def put(self, key, report, pages):
+        """Store pages of a report in the cache.
+        Args:
+            key (str): key of entry.
+            report (str): hash of the report.
+            pages (list): pages as encoded images in the order of pages.
+        """
+        with self._connect() as conn, conn:
+            conn.execute('DELETE FROM pages WHERE key = ?', (key,))
+            conn.executemany('INSERT INTO pages VALUES (?, ?, ?)',
+                             ((key, i + 1, sqlite3.Binary(data)) for i, data in enumerate(pages)))
+            conn.execute('INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?)',
+                         (key, report, len(pages), sum(len(data) for data in pages), time.time()))
+        if self.max_size is not None:
+            self.evict()
+
+    def evict(self, max_size=None):
+        """Remove least recently used reports until total size of pages is at
+        most max_size bytes.
+        Args:
+            max_size (int, optional): maximum total size in bytes. Defaults to
+                                      max_size of the cache.
+
+        Returns:
+            int: number of removed reports.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return 0
+        with self._connect() as conn, conn:
+            total = 0
+            stale = []
+            for key, size in conn.execute('SELECT key, size FROM reports ORDER BY accessed DESC'):
+                total += size
+                if total > max_size:
+                    stale.append((key,))
+            conn.executemany('DELETE FROM reports WHERE key = ?', stale)
+            conn.executemany('DELETE FROM pages WHERE key = ?', stale)
+        if stale:
+            logger.debug('Evicted pages of {} reports from cache.', len(stale))
+        return len(stale)
+
+    def invalidate(self, report=None):
+        """Remove cached pages of one report or of all reports.
+        Args:
+            report (str, optional): hash of the report. If not given, all
+                                    pages are removed.
+
+        Returns:
+            int: number of removed reports.
+        """
+        with self._connect() as conn, conn:
+            if report is None:
+                removed = conn.execute('DELETE FROM reports').rowcount
+                conn.execute('DELETE FROM pages')
+            else:
+                keys = [(key,) for key, in conn.execute('SELECT key FROM reports WHERE report = ?', (report,))]
+                conn.executemany('DELETE FROM reports WHERE key = ?', keys)
+                conn.executemany('DELETE FROM pages WHERE key = ?', keys)
+                removed = len(keys)
+        logger.info('Invalidated pages of {} reports in cache.', removed)
+        return removed
@@ -3,12 +3,27 @@ import os
 import pandas as pd
 from tqdm import tqdm
 import openai
-from pdf2image import convert_from_path
 import base64
-from PIL import Image
 import time
+import asyncio
+import datetime as dt
+from collections import deque
 
 import gptevents as gpte
+from .raster import RasterEngine
+from .encoder import PageEncoder
+from .preprocess import PagePreprocessor
+from .cache import ResponseCache, PageCache, file_hash
+from .journal import Journal
+from .sink import CsvSink
+from .ratelimit import RateLimiter, estimate_tokens, is_retryable
+from .batch import BatchRunner
+from .textlayer import text_pages
+from .metrics import Metrics
+from .streaming import StreamDeadlines, consume_stream, consume_stream_async
+from .workqueue import WorkQueue
+from .store import ParquetStore
+from .schema import response_format, parse_responses
 
 # warning about partial assignment
 pd.options.mode.chained_assignment = None  # default='warn'
@@ -24,24 +39,200 @@ class ChatGPT:
     save_csv = False  # save data as csv file
     # pickle file for saving data
     file_p = 'data.p'
+    storage = 'pickle'  # storage of saved data: 'pickle' or 'parquet'
+    # folder with Parquet files for saving data
+    dir_parquet = 'data.parquet'
+    load_columns = None  # columns to load from saved data, all columns if None
     # csv file for saving data
     file_data_csv = 'data.csv'
+    # journal of processed reports for resuming interrupted runs
+    file_journal = 'journal.jsonl'
+    resume = False  # resume interrupted run from journal
+    # csv file to which rows are streamed while reports are processed
+    file_stream_csv = 'data_stream.csv'
+    file_metrics = 'metrics'  # name of files with metrics of the last run, without extension
+    # columns of rows with responses
+    columns = ['report', 'response', 'input_mode', 'ttft', 'tokens_per_sec']
+    # queries asked for each report keyed by names, query from config if None
+    queries = None
+    requests_per_minute = None  # client-side limit of requests per minute
+    tokens_per_minute = None  # client-side limit of estimated tokens per minute
+    max_retries = 8  # maximum number of retries of a failed request
+    batch_mode = False  # send reports as asynchronous batch jobs
+    # folder for files of batch jobs
+    dir_batch = 'batch'
+    async_mode = False  # process reports concurrently with asyncio
+    max_concurrency = 8  # maximum number of reports in flight in async mode
+    parallel_raster = True  # rasterise pages of reports in a pool of processes
+    save_pages = False  # save images of pages for debugging
+    model = 'gpt-4o'  # model used for analysis of reports
+    detail = 'high'  # level of detail of images of pages
+    max_tokens = 2000  # maximum number of tokens in response
+    structured_output = False  # ask for responses following JSON schema of events, see schema.py
+    resize_dimentions = (2000, 2000)  # maximum size of images of pages
+    dpi = 200  # resolution of rasterisation of pages
+    text_layer = False  # send text of pages with usable text layer instead of images
+    text_min_chars = 200  # minimum number of characters on page for usable text layer
 
     def __init__(self,
                  files_reports: list,
                  save_p: bool,
                  load_p: bool,
-                 save_csv: bool):
+                 save_csv: bool,
+                 async_mode: bool = False,
+                 max_concurrency: int = 8,
+                 parallel_raster: bool = True,
+                 raster_workers: int = None,
+                 save_pages: bool = False,
+                 response_cache: bool = True,
+                 cache_max_age: float = None,
+                 cache_max_size: int = None,
+                 page_cache: bool = True,
+                 page_cache_max_size: int = 2 * 1024 ** 3,
+                 resume: bool = False,
+                 requests_per_minute: int = None,
+                 tokens_per_minute: int = None,
+                 max_retries: int = 8,
+                 batch_mode: bool = False,
+                 batch_poll_interval: float = 60.0,
+                 encoder: PageEncoder = None,
+                 text_layer: bool = False,
+                 preprocessor: PagePreprocessor = None,
+                 api_key: str = None,
+                 base_url: str = None,
+                 timeout: float = None,
+                 metrics_interval: float = 60.0,
+                 stream: bool = False,
+                 connect_timeout: float = 10.0,
+                 first_token_timeout: float = 60.0,
+                 total_timeout: float = 300.0,
+                 work_queue: str = None,
+                 worker_id: str = None,
+                 lease_seconds: float = 600.0,
+                 storage: str = 'pickle',
+                 load_columns: list = None,
+                 structured_output: bool = False,
+                 queries: dict = None):
         # list of files with raw data
         self.files_reports = files_reports
+        # queries asked for each report keyed by names, responses are saved in columns response_<name>,
+        # query from config is asked with responses in column response if not given
+        self.queries = queries
+        # columns of rows with responses
+        self.columns = ['report'] + self.response_columns() + ['input_mode', 'ttft', 'tokens_per_sec']
         # save data as pickle file
         self.save_p = save_p
         # load data as pickle file
         self.load_p = load_p
         # save data as csv file
         self.save_csv = save_csv
-        # client for communicating with GPT4-V
-        self.gpt_client = openai.OpenAI(api_key=gpte.common.get_secrets('openai_api_key'))
+        # storage of saved data, pickle file or Parquet files that are appended to
+        if storage not in ('pickle', 'parquet'):
+            raise ValueError('Unknown storage of data {}.'.format(storage))
+        if storage == 'parquet' and not ParquetStore.available():
+            logger.warning('pyarrow is not installed, saving data as pickle file instead of Parquet files.')
+            storage = 'pickle'
+        self.storage = storage
+        self.store = None
+        if storage == 'parquet':
+            self.store = ParquetStore(os.path.join(gpte.settings.output_dir, self.dir_parquet))
+        # columns to load from saved data, all columns if not given
+        self.load_columns = load_columns
+        # ask for responses following JSON schema of events, parsed into columns by analyse_data
+        self.structured_output = structured_output
+        # key of OpenAI API, read from secret file if not given
+        self.api_key = api_key or gpte.common.get_secrets('openai_api_key')
+        # base URL of API, e.g. of a local stand-in server, default of OpenAI if not given
+        self.base_url = base_url
+        # timeout of requests in seconds, default of client if not given
+        self.timeout = timeout
+        # client for communicating with GPT4-V, retries are handled by the rate limiter
+        self.gpt_client = openai.OpenAI(**self.client_kwargs())
+        # process reports concurrently
+        self.async_mode = async_mode
+        # maximum number of reports in flight at the same time in async mode
+        self.max_concurrency = max_concurrency
+        # async client for communicating with GPT4-V, created on first use
+        self.gpt_client_async = None
+        # rasterise pages of reports in a pool of processes
+        self.parallel_raster = parallel_raster
+        # encoder of pages, PNG with fixed detail level by default
+        self.encoder = encoder or PageEncoder(detail=self.detail)
+        # send text of pages with usable text layer instead of images
+        self.text_layer = text_layer
+        # preprocessor of pages dropping blank and duplicate pages and cropping margins,
+        # pages are sent as rendered if not given
+        self.preprocessor = preprocessor
+        # size of payload of pages encoded and pages and pixels removed by preprocessing in this run
+        self.reset_stats()
+        # engine for rasterising reports, pool is sized to the number of cores by default
+        self.raster = RasterEngine(parallel=parallel_raster, workers=raster_workers, encoder=self.encoder,
+                                   preprocessor=self.preprocessor)
+        # save images of pages for debugging
+        self.save_pages = save_pages
+        # folder for images of pages, unique for each run
+        self.dir_pages = os.path.join(gpte.settings.output_dir, 'pages',
+                                      dt.datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S') + '_' + str(os.getpid()))
+        # on-disk cache of responses, entries older than cache_max_age seconds or
+        # beyond cache_max_size bytes are evicted after each run
+        self.response_cache = None
+        if response_cache:
+            self.response_cache = ResponseCache(max_age=cache_max_age, max_size=cache_max_size)
+        # on-disk cache of rasterised pages, least recently used reports are
+        # evicted beyond page_cache_max_size bytes
+        self.page_cache = None
+        if page_cache:
+            self.page_cache = PageCache(max_size=page_cache_max_size)
+        # hashes of content of reports
+        self.report_hashes = {}
+        # resume interrupted run from journal
+        self.resume = resume
+        # journal with responses written as soon as they are received
+        self.journal = Journal(os.path.join(gpte.settings.output_dir, self.file_journal))
+        # sink to which rows are streamed as they are received
+        self.sink = CsvSink(os.path.join(gpte.settings.output_dir, self.file_stream_csv), self.columns)
+        # queue of reports shared with workers on other machines, each worker
+        # streams its rows to its own file in the folder of the queue
+        self.work_queue = None
+        if work_queue is not None:
+            if batch_mode:
+                raise ValueError('Work queue cannot be used together with batch mode.')
+            self.work_queue = WorkQueue(work_queue, worker_id=worker_id, lease_seconds=lease_seconds)
+            self.sink = CsvSink(self.work_queue.file_partial, self.columns)
+        # timing spans of stages, progress of the run is logged every metrics_interval seconds
+        self.metrics = Metrics(interval=metrics_interval)
+        # stream responses, cancelling and retrying requests that miss deadlines
+        self.stream = stream
+        # deadlines of streamed requests in seconds
+        self.deadlines = StreamDeadlines(connect=connect_timeout, first_token=first_token_timeout,
+                                         total=total_timeout)
+        # limiter of requests and tokens per minute with backoff for failed requests
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.limiter = RateLimiter(requests_per_minute=requests_per_minute,
+                                   tokens_per_minute=tokens_per_minute,
+                                   max_retries=max_retries)
+        # send reports as asynchronous batch jobs
+        self.batch_mode = batch_mode
+        # runner of batch jobs
+        self.batch = BatchRunner(self.gpt_client,
+                                 os.path.join(gpte.settings.output_dir, self.dir_batch),
+                                 poll_interval=batch_poll_interval,
+                                 limiter=self.limiter)
+
+    def client_kwargs(self):
+        """Return arguments of clients of OpenAI.
+
+        Returns:
+            dict: arguments.
+        """
+        kwargs = {'api_key': self.api_key, 'max_retries': 0}
+        if self.base_url is not None:
+            kwargs['base_url'] = self.base_url
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        return kwargs
 
     def read_data(self, filter_data=True, clean_data=True, analyse_data=True):
         """Read data into an attribute.
@@ -56,19 +247,73 @@ class ChatGPT:
         """
         # load data
         if self.load_p:
-            df = gpte.common.load_from_p(self.file_p, 'chatgpt data')
+            df = self.load_data()
         # get data based on the reports
         else:
-            # pandas df to store data
-            df = pd.DataFrame(columns=('report', 'response'))
-            # df = df.transpose()
-            # go over all reports
-            for file in tqdm(os.listdir(self.files_reports)):
-                logger.info('Processing report {}.', file)
-                # get pages as base64_image strings
-                pages = self.pdf_to_base64_image(file, resize_image=True)
-                # feed all pages in the report to GPT-4V at once
-                df = pd.concat([df, self.ask_gptv(file, pages)], ignore_index=True)    
+            files = os.listdir(self.files_reports)
+            # reports are shared with workers on other machines through the queue
+            if self.work_queue is not None:
+                files_new = files
+            # skip reports with responses from an interrupted run or the cache
+            else:
+                files_new = self.start_run(files)
+            self.metrics.reset(total=len(files_new))
+            self.reset_stats()
+            # claim reports from the queue until all reports are done by any worker
+            if self.work_queue is not None:
+                self.read_reports_queue(files_new)
+            # send reports as batch jobs
+            elif self.batch_mode:
+                self.read_reports_batch(files_new)
+            # process reports concurrently
+            elif self.async_mode:
+                asyncio.run(self.read_reports_async(files_new))
+            # go over all reports, upcoming reports are rasterised while waiting for responses
+            else:
+                for file, pages in tqdm(self.pdfs_to_base64_images(files_new, resize_image=True,
+                                                                   resize_dimentions=self.resize_dimentions),
+                                        total=len(files_new)):
+                    with gpte.log_context(report=file):
+                        logger.info('Processing report {}.', file)
+                        # feed all pages in the report to GPT-4V at once
+                        self.record_result(file, self.ask_gptv(file, pages))
+            # stop pool of processes for rasterisation
+            self.raster.shutdown()
+            # report throughput and export timing of stages
+            self.metrics.log_summary()
+            self.save_metrics()
+            # build dataframe once with rows in the order of reports, merging rows of all workers
+            if self.work_queue is not None:
+                df = self.work_queue.merge(self.columns, dtype=self.text_dtypes())
+            else:
+                df = self.sink.read(dtype=self.text_dtypes())
+            order = {file: i for i, file in enumerate(files)}
+            df = df.iloc[df['report'].map(order).argsort(kind='stable')].reset_index(drop=True)
+            # report tokens of prompts served from cache of the provider
+            summary = self.metrics.summary()
+            if summary.get('prompt_tokens'):
+                logger.info('Sent {} prompt tokens, {} of them cached by provider ({:.1f}%).',
+                            summary['prompt_tokens'], summary['cached_tokens'],
+                            100 * summary['cached_tokens'] / summary['prompt_tokens'])
+            # report size of payload of pages encoded in this run, compared with PNG only if it was measured
+            if self.payload_stats['pages'] and not self.encoder.measure:
+                logger.info('Encoded {} pages into {} bytes.', self.payload_stats['pages'],
+                            self.payload_stats['bytes_after'])
+            elif self.payload_stats['pages']:
+                logger.info('Encoded {} pages: {} bytes before and {} bytes after encoding ({:.1f}% saved).',
+                            self.payload_stats['pages'],
+                            self.payload_stats['bytes_before'],
+                            self.payload_stats['bytes_after'],
+                            100 * (1 - self.payload_stats['bytes_after'] / max(1, self.payload_stats['bytes_before'])))
+            # report pages and pixels removed by preprocessing in this run
+            if self.preprocessor is not None:
+                logger.info('Preprocessing dropped {} blank and {} duplicate pages and removed {} pixels.',
+                            self.preprocess_stats['pages_blank'],
+                            self.preprocess_stats['pages_duplicate'],
+                            self.preprocess_stats['pixels_removed'])
+            # remove old entries from cache
+            if self.response_cache is not None:
+                self.response_cache.evict()
             # clean data
             if clean_data:
                 df = self.clean_data(df)
@@ -82,9 +327,9 @@ class ChatGPT:
             df = df.reindex(sorted(df.columns), axis=1)
             # report people that attempted study
             logger.info('Processed {} reports.', df.shape[0])
-        # save to pickle
-        if self.save_p:
-            gpte.common.save_to_p(self.file_p, df, 'chatgpt data')
+        # save to pickle or Parquet files, data loaded from Parquet files is already stored
+        if self.save_p and not (self.load_p and self.store is not None):
+            self.save_data(df)
         # save to csv
         if self.save_csv:
             df.to_csv(os.path.join(gpte.settings.output_dir, self.file_data_csv), index=False)
@@ -94,116 +339,1125 @@ class ChatGPT:
         # return df with data
         return df
 
+    def reset_stats(self):
+        """Start statistics of payload and preprocessing of a new run."""
+        # size of payload of pages encoded in this run
+        self.payload_stats = {'pages': 0, 'bytes_before': 0, 'bytes_after': 0}
+        # pages and pixels removed by preprocessing in this run
+        self.preprocess_stats = {'pages_blank': 0, 'pages_duplicate': 0, 'pixels_removed': 0}
+
+    def start_run(self, files):
+        """Start new run on this machine, taking rows for reports processed
+        before the run was interrupted from the journal and for unchanged
+        reports from the cache.
+        Args:
+            files (list): Names of files of the reports.
+
+        Returns:
+            list: names of files of the reports to process.
+        """
+        # rows with responses are streamed to a file as they arrive
+        self.sink.reset()
+        # reports with responses
+        done = set()
+        # skip reports processed before the run was interrupted
+        if self.resume:
+            for file, rows in self.journal.entries():
+                if file in files and file not in done:
+                    self.sink.append(rows)
+                    done.add(file)
+            logger.info('Resuming run with {} reports processed before.', len(done))
+        # start new journal
+        else:
+            self.journal.reset()
+        # responses for unchanged reports are served from cache without rasterising them
+        for file in files:
+            if file not in done:
+                cached = self.cached_response(file)
+                if cached is not None:
+                    self.sink.append(self.response_to_df(file, **cached).to_dict('records'))
+                    done.add(file)
+        files_new = [file for file in files if file not in done]
+        logger.info('Found responses for {} reports, {} reports to process.', len(done), len(files_new))
+        return files_new
+
     def pdf_to_base64_image(self, file, resize_image=False, resize_dimentions=(2000, 2000)):
-        """Turn pages of the PDF file with the report to base64 strings.
+        """Turn pages of the PDF file with the report to base64 strings. With
+        text_layer on, pages with a usable text layer are returned as
+        dictionaries with number of page and text instead.
         Args:
             file (str): Name of file of the report.
 
         Returns:
             base64_image (list): List of pages as base64 strings.
         """
-        # create full path of the file with the report
-        file = os.fsdecode(file)
+        resize_dimentions = resize_dimentions if resize_image else None
+        return self.finish_report(self.start_report(os.fsdecode(file), resize_dimentions))
+
+    def pdfs_to_base64_images(self, files, resize_image=False, resize_dimentions=(2000, 2000)):
+        """Turn pages of PDF files with reports to base64 strings. Whole reports
+        are spread over the pool of processes if parallel rasterisation is on.
+        Args:
+            files (list): Names of files of the reports.
+
+        Yields:
+            tuple: name of file of the report and list of pages as base64 strings.
+        """
+        resize_dimentions = resize_dimentions if resize_image else None
+        # keep the pool busy with upcoming reports
+        window = 2 * self.raster.workers if self.parallel_raster else 1
+        files = iter(os.fsdecode(file) for file in files)
+        pending = deque()
+        while True:
+            while len(pending) < window:
+                file = next(files, None)
+                if file is None:
+                    break
+                pending.append(self.start_report(file, resize_dimentions))
+            if not pending:
+                return
+            report = pending.popleft()
+            yield report['file'], self.finish_report(report)
+
+    def start_report(self, file, resize_dimentions):
+        """Find pages of the report that need images, take them from cache or
+        start rasterising them.
+        Args:
+            file (str): Name of file of the report.
+            resize_dimentions (tuple): Maximum size of pages or None.
+
+        Returns:
+            dict: state of the report for finish_report.
+        """
         full_path = os.path.join(self.files_reports, file)
-        # each page is 1 base64_image
-        base64_images = []
-        imgs = convert_from_path(full_path)
-        temp_png = 'output_images'
-        if not os.path.exists(temp_png):
-            os.makedirs(temp_png)
-        for i, image in enumerate(imgs):
-            # save generated images. This can be overwritten.
-            image_path = os.path.join(temp_png, f"page_{i+1}.png")
-            # resize image with preserving the aspect ratio
-            if (resize_image):
-                image.thumbnail(resize_dimentions, Image.Resampling.LANCZOS)
-            # save image
-            image.save(image_path, 'PNG')
-            base64_images.append(self.encode_image(image_path))
-        # close image
+        self.metrics.begin(file)
+        # pages with usable text layer are not rasterised
+        with self.metrics.span('text_layer', file):
+            n_pages, texts = self.text_pages(file)
+        selected = [page for page in range(1, n_pages + 1) if page not in texts] if texts else None
+        # reuse pages from cache
+        pages = self.cached_pages(file, resize_dimentions, selected)
+        result = None
+        if pages is None:
+            # rasterise pages, in parallel if enabled
+            result = self.raster.start(full_path, resize_dimentions, self.dpi, selected)
+        return {'file': file, 'resize_dimentions': resize_dimentions, 'n_pages': n_pages, 'texts': texts,
+                'selected': selected, 'pages': pages, 'result': result}
+
+    def finish_report(self, report):
+        """Wait for pages of the report and turn them into base64 strings,
+        combined with text of pages with usable text layer.
+        Args:
+            report (dict): state of the report from start_report.
+
+        Returns:
+            list: List of pages as base64 strings or dictionaries with text.
+        """
+        pages = report['pages']
+        if pages is None:
+            # waiting for rasterisation, which may run ahead in the pool of processes
+            with self.metrics.span('render', report['file']):
+                rendered = report['result']()
+            pages = self.rendered_to_pages(rendered, report['file'])
+            self.cache_pages(report['file'], report['resize_dimentions'], pages, report['selected'])
+        images = self.pages_to_base64_image(report['file'], pages)
+        if report['texts']:
+            images = iter(images)
+            images = [{'page': page, 'text': report['texts'][page]} if page in report['texts'] else next(images)
+                      for page in range(1, report['n_pages'] + 1)]
+        # skip pages dropped by preprocessing
+        return [page for page in images if page is not None]
+
+    def text_pages(self, file):
+        """Return text of pages of the report with usable text layer if
+        text_layer is on.
+        Args:
+            file (str): Name of file of the report.
+
+        Returns:
+            tuple: number of pages and dictionary of texts keyed by numbers of
+                   pages starting from 1.
+        """
+        if not self.text_layer:
+            return None, {}
+        n_pages, texts = text_pages(os.path.join(self.files_reports, file), min_chars=self.text_min_chars)
+        logger.debug('Found usable text layer on {} of {} pages of report {}.', len(texts), n_pages, file)
+        return n_pages, texts
+
+    def input_mode(self, pages):
+        """Return how the report was given to GPT4-V.
+        Args:
+            pages (list): List of pages as base64 strings or dictionaries with text.
+
+        Returns:
+            str: 'image', 'text' or 'mixed'.
+        """
+        n_text = sum(1 for page in pages if isinstance(page, dict))
+        if not n_text:
+            return 'image'
+        return 'text' if n_text == len(pages) else 'mixed'
+
+    def rendered_to_pages(self, rendered, file=None):
+        """Take encoded pages from output of the raster engine, drop pages
+        repeated within the report and add their sizes to the statistics of
+        payload and preprocessing. Durations of stages in worker processes
+        are recorded as spans of the report.
+        Args:
+            rendered (list): List of tuples of encoded page, size before
+                             encoding and information about the page.
+            file (str, optional): Name of file of the report.
+
+        Returns:
+            list: List of pages as encoded images, empty for dropped pages.
+        """
+        pages = []
+        # digests of pages kept so far
+        seen = set()
+        # durations of stages in worker processes summed over pages
+        durations = {}
+        for data, baseline, info in rendered:
+            for stage in ('raster', 'preprocess', 'resize', 'encode'):
+                if stage in info:
+                    durations[stage] = durations.get(stage, 0.0) + info[stage]
+            if 'blank' in info:
+                self.preprocess_stats['pixels_removed'] += info['pixels_removed']
+                # blank page
+                if info['blank']:
+                    self.preprocess_stats['pages_blank'] += 1
+                    pages.append(b'')
+                    continue
+                # page repeated within the report
+                if self.preprocessor.dedupe and self.preprocessor.is_duplicate(info['hash'], seen):
+                    self.preprocess_stats['pages_duplicate'] += 1
+                    pages.append(b'')
+                    continue
+                seen.add(info['hash'])
+            pages.append(data)
+            self.payload_stats['pages'] += 1
+            self.payload_stats['bytes_after'] += len(data)
+            self.payload_stats['bytes_before'] += baseline or len(data)
+        for stage, seconds in durations.items():
+            self.metrics.observe(stage, seconds, file, pages=len(rendered))
+        return pages
+
+    def page_cache_key(self, file, resize_dimentions, selected=None):
+        """Return key of the pages of the report in the cache. The key covers
+        content of the report and parameters of rendering.
+        Args:
+            file (str): File with report.
+            resize_dimentions (tuple): Maximum size of pages or None.
+            selected (list, optional): Numbers of rendered pages, None for all.
+
+        Returns:
+            str: key of entry in cache.
+        """
+        return PageCache.make_key(self.report_hash(file),
+                                  dpi=self.dpi,
+                                  resize_dimentions=list(resize_dimentions) if resize_dimentions else None,
+                                  encoder=self.encoder.key(),
+                                  preprocessor=self.preprocessor.key() if self.preprocessor else None,
+                                  pages=selected)
+
+    def cached_pages(self, file, resize_dimentions, selected=None):
+        """Return cached pages of the report or None.
+        Args:
+            file (str): File with report.
+            resize_dimentions (tuple): Maximum size of pages or None.
+            selected (list, optional): Numbers of rendered pages, None for all.
+
+        Returns:
+            list: List of pages as encoded images.
+        """
+        if self.page_cache is None:
+            return None
+        pages = self.page_cache.get(self.page_cache_key(file, resize_dimentions, selected))
+        if pages is not None:
+            logger.debug('Found pages of report {} in cache.', file)
+        return pages
+
+    def cache_pages(self, file, resize_dimentions, pages, selected=None):
+        """Store pages of the report in cache.
+        Args:
+            file (str): File with report.
+            resize_dimentions (tuple): Maximum size of pages or None.
+            pages (list): List of pages as encoded images.
+            selected (list, optional): Numbers of rendered pages, None for all.
+        """
+        if self.page_cache is not None:
+            self.page_cache.put(self.page_cache_key(file, resize_dimentions, selected), self.report_hash(file),
+                                pages)
+
+    def invalidate_page_cache(self, file=None):
+        """Remove cached pages of the report or of all reports.
+        Args:
+            file (str, optional): File with report. If not given, pages of all
+                                  reports are removed.
+        """
+        if self.page_cache is not None:
+            self.page_cache.invalidate(self.report_hash(file) if file is not None else None)
+
+    def pages_to_base64_image(self, file, pages):
+        """Turn encoded pages of the report to base64 strings in memory.
+        Args:
+            file (str): Name of file of the report.
+            pages (list): List of pages as encoded images.
+
+        Returns:
+            base64_image (list): List of pages as base64 strings, None for
+                                 dropped pages.
+        """
+        # each page is 1 base64_image, dropped pages are None
+        with self.metrics.span('base64', file) as span:
+            base64_images = [self.encode_image(page) if page else None for page in pages]
+            span['pages'] = sum(1 for page in base64_images if page)
+            span['bytes'] = sum(len(page) for page in base64_images if page)
+        self.metrics.count(pages=span['pages'], payload_bytes=span['bytes'])
+        # save images of pages for debugging
+        if self.save_pages:
+            path = os.path.join(self.dir_pages, os.path.splitext(file)[0])
+            if not os.path.exists(path):
+                os.makedirs(path)
+            for i, page in enumerate(pages):
+                if not page:
+                    continue
+                with open(os.path.join(path, f"page_{i+1}.{self.encoder.fmt.lower()}"), 'wb') as f:
+                    f.write(page)
+            logger.debug('Saved images of pages of report {} to {}.', file, path)
         logger.debug('Turned report {} into base64 images.', file)
-        # combine all base64 images into one string
-        # base64_images = ''.join(base64_images)
         return base64_images
 
-    def encode_image(self, image_path):
+    def encode_image(self, image):
         """Return base64 string for an image.
         Args:
-            image_path (TYPE): Path of image.
+            image (str or bytes): Path of image or encoded image.
 
         Returns:
             str: encoded string.
         """
-        with open(image_path, "rb") as imageFile:
+        # image is already in memory
+        if isinstance(image, (bytes, bytearray)):
+            return base64.b64encode(image).decode('utf-8')
+        with open(image, "rb") as imageFile:
             return base64.b64encode(imageFile.read()).decode('utf-8')
 
-    def ask_gptv(self, file, pages):
-        """Receive responses from GPT4 for all pages at once.
+    def query_items(self):
+        """Return queries asked for each report with columns of their
+        responses.
+
+        Returns:
+            list: tuples of column and query.
+        """
+        if not self.queries:
+            return [('response', gpte.common.get_configs('query'))]
+        return [('response_' + name, query) for name, query in self.queries.items()]
+
+    def response_columns(self):
+        """Return columns of responses to queries.
+
+        Returns:
+            list: columns.
+        """
+        if not self.queries:
+            return ['response']
+        return ['response_' + name for name in self.queries]
+
+    def text_dtypes(self):
+        """Return types of columns with text, so that reports and responses
+        are read from CSV files as written, e.g. N/A, None and 42.
+
+        Returns:
+            dict: str keyed by columns.
+        """
+        return {column: str for column in ['report'] + self.response_columns() + ['input_mode']}
+
+    def build_content(self, pages, query=None):
+        """Build content of the request with all pages and the query. Pages
+        come first and the query last, so that requests with different
+        queries for the same report share a prefix that can be cached by the
+        provider.
         Args:
-            file (str): File with report.
             pages (list): List of pages as base64 strings.
+            query (str, optional): Query, query from config if not given.
 
         Returns:
-            dataframe: dataframe with responses.
+            list: content for the message to GPT4-V.
         """
         # build content with multiple images
-        # first add a query to the content list
-        content = [{
-                      "type": "text",
-                      "text": gpte.common.get_configs('query'),
-                    }
-                   ]
+        content = []
         # populate the list with base64 strings of pages in the report
         for page in pages:
+            # text of page with usable text layer
+            if isinstance(page, dict):
+                content.append({
+                          "type": "text",
+                          "text": "Page {}:\n{}".format(page['page'], page['text']),
+                        })
+                continue
+            # detail level may be chosen per page
+            detail = self.encoder.detail_for(base64.b64decode(page)) if self.encoder.adaptive else self.encoder.detail
             content.append({
                       "type": "image_url",
                       "image_url": {
-                        "url": f"data:image/png;base64,{page}",
-                        "detail": "high"
+                        "url": f"data:{self.encoder.mime};base64,{page}",
+                        "detail": detail
                       },
                     })
-        # object to store response
-        response = None
-        # send request to GPT4-V
-        try:
-            response = self.gpt_client.chat.completions.create(
-              model="gpt-4o",
-              messages=[
-                {
-                  "role": "user",
-                  "content": content
-                }
-              ],
-              max_tokens=2000,
-            )
-            logger.debug('Received response from GPT4-V: {}.', response.choices[0])
-        except openai.AuthenticationError:
+        # add the query after the pages
+        content.append({
+                  "type": "text",
+                  "text": query if query is not None else gpte.common.get_configs('query'),
+                })
+        return content
+
+    def build_request(self, content):
+        """Build body of the request to GPT4-V.
+        Args:
+            content (list): content for the message to GPT4-V.
+
+        Returns:
+            dict: parameters of the request.
+        """
+        request = {
+          "model": self.model,
+          "messages": [
+            {
+              "role": "user",
+              "content": content
+            }
+          ],
+          "max_tokens": self.max_tokens,
+        }
+        # ask for response following JSON schema
+        if self.structured_output:
+            request["response_format"] = response_format()
+        return request
+
+    def ask_gptv(self, file, pages):
+        """Receive responses from GPT4 to all queries, each with all pages at
+        once. Pages are encoded once and sent as the same prefix of the
+        requests for all queries, which are sent one after another so that
+        the provider can reuse the cached prefix.
+        Args:
+            file (str): File with report.
+            pages (list): List of pages as base64 strings.
+
+        Returns:
+            dataframe: dataframe with responses.
+        """
+        responses, timings = {}, []
+        for column, query, content in self.pending_queries(file, pages, responses):
+            result = self.request_gptv(file, content)
+            if result is None:
+                return None
+            self.store_query(file, pages, column, query, result, responses, timings)
+        return self.queries_to_df(file, pages, responses, timings)
+
+    def request_gptv(self, file, content):
+        """Send request with content to GPT4-V, retrying transient errors
+        with backoff.
+        Args:
+            file (str): File with report.
+            content (list): content for the message to GPT4-V.
+
+        Returns:
+            tuple: response and dictionary with timing of streamed response,
+                   or None if the request failed.
+        """
+        tokens = estimate_tokens(content, self.max_tokens)
+        # send request to GPT4-V, retrying transient errors with backoff
+        for attempt in range(self.max_retries + 1):
+            with self.metrics.span('rate_limit', file):
+                self.limiter.acquire(tokens)
+            try:
+                # upload of pages and latency of model
+                with self.metrics.span('request', file, attempt=attempt, tokens=tokens, status='error') as span:
+                    start = time.monotonic()
+                    raw = self.gpt_client.chat.completions.with_raw_response.create(**self.request_kwargs(content))
+                    parsed = self.parse_raw_response(raw)
+                    if self.stream:
+                        parsed = consume_stream(parsed, self.deadlines, start)
+                    result = self.shape_response(parsed, file)
+                    span['status'] = 'ok'
+                return result
+            except openai.APIError as e:
+                delay = self.failure_delay(file, attempt, e)
+                if delay is None:
+                    return None
+                time.sleep(delay)
+
+    def pending_queries(self, file, pages, responses):
+        """Serve responses to queries from cache and yield the queries that
+        need to be sent, with content of their requests.
+        Args:
+            file (str): File with report.
+            pages (list): List of pages as base64 strings.
+            responses (dict): responses keyed by column, filled with cached
+                              responses.
+
+        Yields:
+            tuple: column, query and content of request.
+        """
+        for column, query in self.query_items():
+            # serve response from cache
+            cached = self.cached_query(file, query)
+            if cached is not None:
+                responses[column] = cached['response']
+                continue
+            yield column, query, self.build_content(pages, query)
+
+    def store_query(self, file, pages, column, query, result, responses, timings):
+        """Keep response to a query and store it in cache.
+        Args:
+            file (str): File with report.
+            pages (list): List of pages as base64 strings.
+            column (str): column of response.
+            query (str): query.
+            result (tuple): response and dictionary with timing.
+            responses (dict): responses keyed by column.
+            timings (list): timings of responses.
+        """
+        responses[column], timing = result
+        timings.append(timing)
+        self.cache_response(file, responses[column], self.input_mode(pages), query)
+
+    def queries_to_df(self, file, pages, responses, timings):
+        """Turn responses to all queries of a report into a dataframe.
+        Args:
+            file (str): File with report.
+            pages (list): List of pages as base64 strings.
+            responses (dict): responses keyed by column.
+            timings (list): timings of responses.
+
+        Returns:
+            dataframe: dataframe with responses.
+        """
+        return self.response_to_df(file, responses, self.input_mode(pages), **self.merge_timings(timings))
+
+    def request_kwargs(self, content):
+        """Return arguments of the request to the client, with deadline of
+        the first byte if the response is streamed.
+        Args:
+            content (list): content for the message to GPT4-V.
+
+        Returns:
+            dict: arguments of request.
+        """
+        if self.stream:
+            return dict(self.build_request(content), stream=True, timeout=self.deadlines.timeout())
+        return self.build_request(content)
+
+    def parse_raw_response(self, raw):
+        """Update the rate limiter from headers of the response and parse it,
+        counting usage of completions that are not streamed.
+        Args:
+            raw (LegacyAPIResponse): raw response of the client.
+
+        Returns:
+            ChatCompletion or Stream: completion or stream of chunks.
+        """
+        self.limiter.update_from_headers(raw.headers)
+        parsed = raw.parse()
+        if not self.stream:
+            self.count_usage(parsed)
+        return parsed
+
+    def shape_response(self, parsed, file):
+        """Take content and timing of a response.
+        Args:
+            parsed (ChatCompletion or StreamResult): completion or consumed
+                                                     stream.
+            file (str): File with report.
+
+        Returns:
+            tuple: response and dictionary with timing of streamed response.
+        """
+        if self.stream:
+            response, timing = self.stream_to_response(parsed, file)
+        else:
+            response, timing = parsed.choices[0].message.content, {}
+        logger.debug('Received response from GPT4-V: {}.', response)
+        return response, timing
+
+    def failure_delay(self, file, attempt, error):
+        """Classify a failed request and return delay before retrying it or
+        None if the request should not be retried.
+        Args:
+            file (str): File with report.
+            attempt (int): number of failed attempts so far, starting at 0.
+            error (openai.APIError): error raised by the client.
+
+        Returns:
+            float: delay in seconds.
+        """
+        if isinstance(error, openai.AuthenticationError):
             logger.error('Incorrect API key provided to OpenAI.')
             return None
-        except openai.BadRequestError as e:
-            logger.error('Bad request given to OpenAI: {}.', e)
+        if isinstance(error, openai.BadRequestError):
+            logger.error('Bad request given to OpenAI: {}.', error)
+            return None
+        return self.retry_delay(file, attempt, error)
+
+    def count_usage(self, completion):
+        """Count tokens of the prompt and tokens of the prompt served from
+        the cache of the provider.
+        Args:
+            completion (ChatCompletion): response.
+        """
+        usage = getattr(completion, 'usage', None)
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        # field is not known to older clients and kept as a dictionary
+        if isinstance(details, dict):
+            cached = details.get('cached_tokens') or 0
+        else:
+            cached = getattr(details, 'cached_tokens', None) or 0
+        self.metrics.count(prompt_tokens=usage.prompt_tokens or 0, cached_tokens=cached)
+
+    @staticmethod
+    def merge_timings(timings):
+        """Average timing of streamed responses to the queries of a report.
+        Args:
+            timings (list): dictionaries with time to first token and tokens
+                            per second.
+
+        Returns:
+            dict: average time to first token and tokens per second.
+        """
+        merged = {}
+        for key in ('ttft', 'tokens_per_sec'):
+            values = [timing[key] for timing in timings if timing.get(key) is not None]
+            merged[key] = sum(values) / len(values) if values else None
+        return merged
+
+    def stream_to_response(self, result, file):
+        """Take content and timing of a streamed response and record the
+        timing as spans of the report.
+        Args:
+            result (StreamResult): streamed response.
+            file (str): File with report.
+
+        Returns:
+            tuple: content of response and dictionary with time to first token
+                   and tokens per second.
+        """
+        if result.ttft is not None:
+            self.metrics.observe('first_token', result.ttft, file)
+        self.metrics.observe('stream', result.end - result.start, file, tokens=result.tokens)
+        return result.content, {'ttft': result.ttft, 'tokens_per_sec': result.tokens_per_sec}
+
+    def retry_delay(self, file, attempt, error):
+        """Return delay before retrying a failed request or None if the
+        request should not be retried.
+        Args:
+            file (str): File with report.
+            attempt (int): number of failed attempts so far, starting at 0.
+            error (Exception): error raised by the client.
+
+        Returns:
+            float: delay in seconds.
+        """
+        if not is_retryable(error):
+            logger.error('Request for report {} failed: {}.', file, error)
+            return None
+        if attempt >= self.max_retries:
+            logger.error('Request for report {} failed after {} retries: {}.', file, attempt, error)
             return None
-        except openai.RateLimitError:
-            logger.warning('Rate limit exceeded. Retrying after a short delay...')
-            time.sleep(60)  # wait 60 seconds
-            return self.ask_gptv(file, pages)
-        # turn response into a dataframe
-        data = {'report': [file], 'response': [response.choices[0].message.content]}
-        df = pd.DataFrame(data)
+        delay = self.limiter.backoff(attempt, error)
+        logger.warning('{} for report {}. Retrying in {:.1f} s (attempt {} of {}).',
+                       type(error).__name__, file, delay, attempt + 1, self.max_retries)
+        return delay
+
+    async def ask_gptv_async(self, file, pages):
+        """Receive responses from GPT4 to all queries, each with all pages at
+        once, without blocking the event loop. Queries of a report are sent
+        one after another so that the provider can reuse the cached prefix.
+        Args:
+            file (str): File with report.
+            pages (list): List of pages as base64 strings.
+
+        Returns:
+            dataframe: dataframe with responses.
+        """
+        responses, timings = {}, []
+        for column, query, content in self.pending_queries(file, pages, responses):
+            result = await self.request_gptv_async(file, content)
+            if result is None:
+                return None
+            self.store_query(file, pages, column, query, result, responses, timings)
+        return self.queries_to_df(file, pages, responses, timings)
+
+    async def request_gptv_async(self, file, content):
+        """Send request with content to GPT4-V without blocking the event
+        loop, retrying transient errors with backoff.
+        Args:
+            file (str): File with report.
+            content (list): content for the message to GPT4-V.
+
+        Returns:
+            tuple: response and dictionary with timing of streamed response,
+                   or None if the request failed.
+        """
+        # create async client on first use
+        if self.gpt_client_async is None:
+            self.gpt_client_async = openai.AsyncOpenAI(**self.client_kwargs())
+        tokens = estimate_tokens(content, self.max_tokens)
+        # send request to GPT4-V, retrying transient errors with backoff
+        for attempt in range(self.max_retries + 1):
+            with self.metrics.span('rate_limit', file):
+                await self.limiter.acquire_async(tokens)
+            try:
+                # upload of pages and latency of model
+                with self.metrics.span('request', file, attempt=attempt, tokens=tokens, status='error') as span:
+                    start = time.monotonic()
+                    raw = await self.gpt_client_async.chat.completions.with_raw_response.create(
+                      **self.request_kwargs(content))
+                    parsed = self.parse_raw_response(raw)
+                    if self.stream:
+                        parsed = await consume_stream_async(parsed, self.deadlines, start)
+                    result = self.shape_response(parsed, file)
+                    span['status'] = 'ok'
+                return result
+            except openai.APIError as e:
+                delay = self.failure_delay(file, attempt, e)
+                if delay is None:
+                    return None
+                await asyncio.sleep(delay)
+
+    async def read_reports_async(self, files):
+        """Process reports concurrently with at most max_concurrency reports
+        in flight. A failure in one report does not stop the others.
+        Args:
+            files (list): Names of files of the reports.
+
+        Returns:
+            list: names of files of the reports with responses.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        progress = tqdm(total=len(files))
+
+        async def process(file):
+            async with semaphore:
+                with gpte.log_context(report=file):
+                    logger.info('Processing report {}.', file)
+                    try:
+                        # rasterise in a thread to keep the event loop free for requests
+                        pages = await asyncio.to_thread(self.pdf_to_base64_image, file, resize_image=True,
+                                                        resize_dimentions=self.resize_dimentions)
+                        result = await self.ask_gptv_async(file, pages)
+                        self.record_result(file, result)
+                        return result is not None
+                    except Exception as e:
+                        logger.error('Failed to process report {}: {}.', file, e)
+                        self.metrics.end(file)
+                        return False
+                    finally:
+                        progress.update(1)
+
+        try:
+            results = await asyncio.gather(*(process(file) for file in files))
+        finally:
+            progress.close()
+            # release connections of the async client within the running loop
+            if self.gpt_client_async is not None:
+                await self.gpt_client_async.close()
+                self.gpt_client_async = None
+        # keep only reports with responses
+        return [file for file, result in zip(files, results) if result]
+
+    def read_reports_queue(self, files):
+        """Process reports shared with workers on other machines. Reports are
+        claimed from the work queue in groups of max_concurrency, so that each
+        report is processed by one worker, and leases of the remaining reports
+        of the group are renewed after each report. Reports leased by workers
+        that stopped are claimed again after their leases expire. Returns once
+        no report is pending or leased.
+        Args:
+            files (list): Names of files of the reports.
+
+        Returns:
+            list: names of files of the reports with responses from this worker.
+        """
+        self.work_queue.add(files)
+        # rows of this worker are kept in its file of the queue, the journal is not used for resuming
+        self.sink.reset()
+        self.journal.reset()
+        done = []
+        while True:
+            claimed = self.work_queue.claim(self.max_concurrency)
+            # wait for reports leased by other workers, they are claimed again if their leases expire
+            if not claimed:
+                unfinished = self.work_queue.unfinished()
+                if not unfinished:
+                    break
+                logger.info('Waiting for {} reports leased by other workers.', unfinished)
+                time.sleep(self.work_queue.poll_interval)
+                continue
+            # responses for unchanged reports are served from cache without rasterising them
+            todo = []
+            for file in claimed:
+                cached = self.cached_response(file)
+                if cached is None:
+                    todo.append(file)
+                else:
+                    self.sink.append(self.response_to_df(file, **cached).to_dict('records'))
+                    self.work_queue.complete(file)
+                    done.append(file)
+            # process reports concurrently, leases are released after the whole group
+            if self.async_mode:
+                succeeded = set(asyncio.run(self.read_reports_async(todo)))
+                for file in todo:
+                    if file not in succeeded:
+                        self.work_queue.fail(file)
+                    elif self.work_queue.complete(file):
+                        done.append(file)
+                continue
+            # upcoming reports are rasterised while waiting for responses
+            reports = self.pdfs_to_base64_images(todo, resize_image=True, resize_dimentions=self.resize_dimentions)
+            for i, (file, pages) in enumerate(reports):
+                with gpte.log_context(report=file):
+                    logger.info('Processing report {}.', file)
+                    df = self.ask_gptv(file, pages)
+                    self.record_result(file, df)
+                if df is None:
+                    self.work_queue.fail(file)
+                elif self.work_queue.complete(file):
+                    done.append(file)
+                # keep leases of reports of the group that are still waiting
+                self.work_queue.renew(todo[i + 1:])
+        counts = self.work_queue.counts()
+        logger.info('Work queue finished: {} reports done and {} failed, {} processed by worker {}.',
+                    counts['done'], counts['failed'], len(done), self.work_queue.worker_id)
+        return done
+
+    def read_reports_batch(self, files):
+        """Process reports as asynchronous batch jobs: submit all requests,
+        wait for the batches to finish and merge their results. Batches
+        submitted by an interrupted run are collected first, and only reports
+        without responses from them are submitted again.
+        Args:
+            files (list): Names of files of the reports.
+
+        Returns:
+            list: names of files of the reports with responses.
+        """
+        done = []
+        pending = self.batch.submitted()
+        if pending:
+            logger.info('Collecting {} batches submitted before.', len(pending))
+            done = self.collect_batch(pending, files)
+        files = [file for file in files if file not in done]
+        if not files:
+            return done
+        return done + self.collect_batch(self.submit_batch(files))
+
+    def submit_batch(self, files):
+        """Serialise requests for reports to JSONL files and submit them as
+        batch jobs.
+        Args:
+            files (list): Names of files of the reports.
+
+        Returns:
+            list: ids of batches.
+        """
+        # one request for each query of each report, with ids of report and column of response
+        requests = ((self.batch_id(file, column), self.build_request(self.build_content(pages, query)))
+                    for file, pages in self.pdfs_to_base64_images(files, resize_image=True,
+                                                                  resize_dimentions=self.resize_dimentions)
+                    for column, query in self.query_items())
+        paths = self.batch.write(requests)
+        self.raster.shutdown()
+        if not paths:
+            return []
+        return self.batch.submit(paths)
+
+    def collect_batch(self, batch_ids=None, files=None):
+        """Wait for batch jobs to finish and merge their results into the
+        journal, the sink and the cache.
+        Args:
+            batch_ids (list, optional): ids of batches. Defaults to batches
+                                        submitted and not collected yet.
+            files (list, optional): Names of files of the reports to collect,
+                                    all reports in the batches if not given.
+
+        Returns:
+            list: names of files of the reports with responses.
+        """
+        if batch_ids is None:
+            batch_ids = self.batch.submitted()
+        if not batch_ids:
+            return []
+        queries = dict(self.query_items())
+        # responses of reports keyed by columns, collected until all queries of a report are answered
+        responses = {}
+        # how reports were given to GPT4-V, found once for each report
+        input_modes = {}
+        for custom_id, response, error in self.batch.results(self.batch.wait(batch_ids)):
+            file, column = self.split_batch_id(custom_id)
+            # skip reports processed otherwise and queries that are not asked anymore
+            if (files is not None and file not in files) or column not in queries:
+                continue
+            if error is not None:
+                logger.error('Request for report {} in batch failed: {}.', file, error)
+                continue
+            if file not in input_modes:
+                input_modes[file] = self.batch_input_mode(file)
+            self.cache_response(file, response, input_modes[file], queries.get(column))
+            responses.setdefault(file, {})[column] = response
+        done = []
+        for file, received in responses.items():
+            if len(received) < len(queries):
+                logger.error('Responses to {} of {} queries for report {} missing in batch.',
+                             len(queries) - len(received), len(queries), file)
+                continue
+            self.record_result(file, self.response_to_df(file, received, input_modes[file]))
+            done.append(file)
+        # results are collected, batches are not collected again
+        self.batch.forget(batch_ids)
+        logger.info('Received responses for {} reports from batches.', len(done))
+        return done
+
+    def batch_id(self, file, column):
+        """Return id of request in batch for the query of the report.
+        Args:
+            file (str): File with report.
+            column (str): Column of response to query.
+
+        Returns:
+            str: id of request.
+        """
+        if not self.queries:
+            return file
+        return '{}#{}'.format(file, column)
+
+    def split_batch_id(self, custom_id):
+        """Return report and column of response of a request in batch.
+        Args:
+            custom_id (str): id of request.
+
+        Returns:
+            tuple: file with report and column of response.
+        """
+        if not self.queries:
+            return custom_id, 'response'
+        file, _, column = custom_id.rpartition('#')
+        return file, column
+
+    def batch_input_mode(self, file):
+        """Return how the report was given to GPT4-V in a batch job.
+        Args:
+            file (str): File with report.
+
+        Returns:
+            str: 'image', 'text' or 'mixed'.
+        """
+        n_pages, texts = self.text_pages(file)
+        if not texts:
+            return 'image'
+        return 'text' if len(texts) == n_pages else 'mixed'
+
+    def record_result(self, file, df):
+        """Write rows with responses for the report to the journal and stream
+        them to the sink.
+        Args:
+            file (str): File with report.
+            df (dataframe): dataframe with responses or None.
+        """
+        if df is not None:
+            rows = df.to_dict('records')
+            self.journal.append(file, rows)
+            self.sink.append(rows)
+        self.metrics.end(file)
+
+    def load_data(self):
+        """Load saved data. Only load_columns are read, from memory-mapped
+        files with Parquet storage.
+
+        Returns:
+            dataframe: saved data.
+        """
+        if self.store is not None:
+            df = self.store.read(columns=self.load_columns)
+            logger.info('Loaded chatgpt data from {}.', self.store.path)
+            return df
+        df = gpte.common.load_from_p(self.file_p, 'chatgpt data')
+        if self.load_columns is not None:
+            df = df[self.load_columns]
         return df
 
+    def save_data(self, df):
+        """Save data. With Parquet storage, rows of reports that are not stored
+        yet or differ from the stored rows are appended as a new partition, e.g.
+        responses served from cache for other queries or values changed by
+        cleaning. Stored rows are rewritten only if stored reports are missing
+        in data or columns changed.
+        Args:
+            df (dataframe): data.
+        """
+        if self.store is None:
+            gpte.common.save_to_p(self.file_p, df, 'chatgpt data')
+            return
+        stored = self.store.read(memory_map=False)
+        if ('report' not in df or 'report' not in stored or stored.empty or set(stored['report']) - set(df['report'])
+                or set(stored.columns) != set(df.columns)):
+            self.store.write(df)
+        else:
+            self.store.append(df[self.store.changed(df, stored)])
+
+    def save_metrics(self):
+        """Export timing spans of the last run as JSON and in Prometheus text
+        format to the output folder.
+        """
+        path = os.path.join(gpte.settings.output_dir, self.file_metrics)
+        self.metrics.to_json(path + '.json')
+        self.metrics.to_prometheus(path + '.prom')
+        for stage, histogram in sorted(self.metrics.histograms().items()):
+            logger.info('Stage {}: {} spans, {:.2f} s in total, median {:.3f} s, p95 {:.3f} s.',
+                        stage, histogram['count'], histogram['sum'], histogram['p50'], histogram['p95'])
+
+    def iter_data(self, chunksize=1000):
+        """Read rows streamed during the last run lazily in chunks.
+        Args:
+            chunksize (int, optional): Number of rows in each chunk.
+
+        Returns:
+            iterator: iterator over dataframes.
+        """
+        return self.sink.read(chunksize=chunksize, dtype=self.text_dtypes())
+
+    def response_to_df(self, file, response, input_mode='image', ttft=None, tokens_per_sec=None):
+        """Turn responses for the report into a dataframe.
+        Args:
+            file (str): File with report.
+            response (str): Response from GPT4-V or dictionary with responses
+                            to queries keyed by their columns.
+            input_mode (str, optional): How the report was given to GPT4-V:
+                                        'image', 'text' or 'mixed'.
+            ttft (float, optional): Time to first token of streamed response.
+            tokens_per_sec (float, optional): Tokens per second of streamed
+                                              response.
+
+        Returns:
+            dataframe: dataframe with response.
+        """
+        responses = response if isinstance(response, dict) else {'response': response}
+        data = {'report': [file]}
+        data.update({column: [text] for column, text in responses.items()})
+        data.update({'input_mode': [input_mode], 'ttft': [ttft], 'tokens_per_sec': [tokens_per_sec]})
+        return pd.DataFrame(data)
+
+    def report_hash(self, file):
+        """Return hash of content of the report. Computed once per version of
+        the file.
+        Args:
+            file (str): File with report.
+
+        Returns:
+            str: hash of report.
+        """
+        full_path = os.path.join(self.files_reports, os.fsdecode(file))
+        stat = os.stat(full_path)
+        if self.report_hashes.get(full_path, (None,))[0] != (stat.st_mtime, stat.st_size):
+            self.report_hashes[full_path] = ((stat.st_mtime, stat.st_size), file_hash(full_path))
+        return self.report_hashes[full_path][1]
+
+    def response_cache_key(self, file, query=None):
+        """Return key of the response for the report in the cache. The key
+        covers content of the report, query, model and parameters of images.
+        Args:
+            file (str): File with report.
+            query (str, optional): Query, query from config if not given.
+
+        Returns:
+            str: key of entry in cache.
+        """
+        return ResponseCache.make_key(report=self.report_hash(file),
+                                      query=query if query is not None else gpte.common.get_configs('query'),
+                                      model=self.model,
+                                      resize_dimentions=list(self.resize_dimentions),
+                                      detail=self.encoder.detail,
+                                      encoder=self.encoder.key(),
+                                      preprocessor=self.preprocessor.key() if self.preprocessor else None,
+                                      text_layer=self.text_min_chars if self.text_layer else None,
+                                      response_format=response_format() if self.structured_output else None)
+
+    def cached_query(self, file, query=None):
+        """Return cached response to the query for the report or None.
+        Args:
+            file (str): File with report.
+            query (str, optional): Query, query from config if not given.
+
+        Returns:
+            dict: response and how the report was given to GPT4-V.
+        """
+        if self.response_cache is None:
+            return None
+        entry = self.response_cache.get_entry(self.response_cache_key(file, query))
+        if entry is None:
+            return None
+        logger.debug('Found response for report {} in cache.', file)
+        return {'response': entry[0], 'input_mode': entry[1].get('input_mode', 'image')}
+
+    def cached_response(self, file):
+        """Return cached responses to all queries for the report or None if
+        a response is missing.
+        Args:
+            file (str): File with report.
+
+        Returns:
+            dict: responses keyed by their columns and how the report was
+                  given to GPT4-V.
+        """
+        responses = {}
+        for column, query in self.query_items():
+            cached = self.cached_query(file, query)
+            if cached is None:
+                return None
+            responses[column] = cached['response']
+        return {'response': responses, 'input_mode': cached['input_mode']}
+
+    def cache_response(self, file, response, input_mode='image', query=None):
+        """Store response for the report in cache. Responses without content,
+        e.g. refusals, are not cached and are requested again in the next run.
+        Args:
+            file (str): File with report.
+            response (str): Response from GPT4-V, None if it has no content.
+            input_mode (str, optional): How the report was given to GPT4-V.
+            query (str, optional): Query, query from config if not given.
+        """
+        if response is None:
+            logger.warning('Response for report {} has no content, it is not cached.', file)
+            return
+        if self.response_cache is not None:
+            self.response_cache.put(self.response_cache_key(file, query), response, {'input_mode': input_mode})
 
-                
-    # TODO: analysis of data from GPT4-V (PB, LZ)
     def analyse_data(self, df):
-        """Analyse responses from GPT4-V for all reports.
+        """Analyse responses from GPT4-V for all reports. Structured responses
+        are parsed and validated in one pass over all reports into typed
+        columns av_at_fault, collision_type, speed_mph, injuries and summary.
+        Rows with responses that do not follow the schema are flagged in
+        columns structured_valid and structured_error and are not requested
+        again.
         Args:
-            df (TYPE): Dataframe with responses from GPT4-V for all reports.
+            df (dataframe): Dataframe with responses from GPT4-V for all reports.
 
         Returns:
             dataframe: updated dataframe.
         """
-        logger.error('Analysis of data not implemented.')
+        if not self.structured_output:
+            logger.info('Responses are free text, use structured_output to analyse them.')
+            return df
+        for column in self.response_columns():
+            # fields of responses to named queries are prefixed with the name of the query
+            prefix = '' if column == 'response' else column[len('response_'):] + '_'
+            fields = parse_responses(df[column]).add_prefix(prefix)
+            # report rows with responses not following the schema
+            n_invalid = int((~fields[prefix + 'structured_valid']).sum())
+            if n_invalid:
+                logger.warning('{} of {} responses in column {} do not follow the schema, see column {}.',
+                               n_invalid, df.shape[0], column, prefix + 'structured_error')
+            # replace columns from earlier analysis, e.g. of loaded data
+            df = pd.concat([df.drop(columns=list(fields.columns), errors='ignore'), fields], axis=1)
         return df
 
     def filter_data(self, df):
@@ -0,0 +1,129 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import io
+from PIL import Image
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+class PageEncoder:
+    """Encoder of rasterised pages for requests to GPT4-V. Supports PNG, JPEG
+    and WebP at tunable quality, grayscale and 1-bit output for scanned
+    text, and adaptive choice of resolution and detail level per page based
+    on density of content. Objects are sent to worker processes, so they
+    only hold plain settings.
+    """
+    # MIME types of formats
+    mime_types = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+    def __init__(self, fmt='PNG', quality=85, mode='RGB', adaptive=False, detail='high',
+                 low_dimentions=(512, 512), density_threshold=0.02, threshold_1bit=160, measure=False):
+        fmt = fmt.upper()
+        if fmt not in self.mime_types:
+            raise ValueError('Unsupported format of pages: {}.'.format(fmt))
+        if mode not in ('RGB', 'L', '1'):
+            raise ValueError('Unsupported mode of pages: {}.'.format(mode))
+        # format of images: PNG, JPEG or WEBP
+        self.fmt = fmt
+        # quality of lossy formats between 1 and 100
+        self.quality = quality
+        # colour mode: RGB, L for grayscale or 1 for black and white
+        self.mode = mode
+        # choose resolution and detail per page based on density of content
+        self.adaptive = adaptive
+        # detail level of pages with dense content
+        self.detail = detail
+        # maximum size of sparse pages sent with low detail
+        self.low_dimentions = tuple(low_dimentions)
+        # fraction of dark pixels below which page is sparse
+        self.density_threshold = density_threshold
+        # grey level below which pixels are black in 1-bit mode
+        self.threshold_1bit = threshold_1bit
+        # also encode pages as PNG to report size of payload before encoding
+        self.measure = measure
+
+    @property
+    def mime(self):
+        """MIME type of encoded pages."""
+        return self.mime_types[self.fmt]
+
+    def key(self):
+        """Return settings that change encoded pages, for keys of caches.
+
+        Returns:
+            dict: settings of encoder.
+        """
+        return {'fmt': self.fmt,
+                'quality': self.quality if self.fmt != 'PNG' else None,
+                'mode': self.mode,
+                'adaptive': self.adaptive,
+                'low_dimentions': list(self.low_dimentions) if self.adaptive else None,
+                'density_threshold': self.density_threshold if self.adaptive else None,
+                'threshold_1bit': self.threshold_1bit if self.mode == '1' else None}
+
+    def density(self, image):
+        """Return fraction of dark pixels on a downscaled grayscale copy of the
+        page.
+        Args:
+            image (PIL.Image): page.
+
+        Returns:
+            float: density of content between 0 and 1.
+        """
+        small = image.convert('L')
+        small.thumbnail((256, 256))
+        histogram = small.histogram()
+        return sum(histogram[:200]) / max(1, sum(histogram))
+
+    def encode(self, image):
+        """Encode page.
+        Args:
+            image (PIL.Image): page.
+
+        Returns:
+            tuple: encoded page as bytes and size of page encoded as RGB PNG
+                   in bytes if measure is on, otherwise None.
+        """
+        baseline = None
+        if self.measure:
+            buffer = io.BytesIO()
+            image.save(buffer, 'PNG')
+            baseline = buffer.tell()
+        # sparse pages are sent at lower resolution
+        if self.adaptive and self.density(image) < self.density_threshold:
+            image = image.copy()
+            image.thumbnail(self.low_dimentions, Image.Resampling.LANCZOS)
+        # colour mode
+        if self.mode == '1':
+            image = image.convert('L').point(lambda p: 255 if p > self.threshold_1bit else 0, mode='1')
+        elif image.mode != self.mode:
+            image = image.convert(self.mode)
+        # JPEG does not support 1-bit and WebP only supports colour images
+        if self.fmt == 'JPEG' and image.mode == '1':
+            image = image.convert('L')
+        elif self.fmt == 'WEBP' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        if self.fmt == 'PNG':
+            image.save(buffer, 'PNG', optimize=self.mode == '1')
+        else:
+            image.save(buffer, self.fmt, quality=self.quality)
+        return buffer.getvalue(), baseline
+
+    def detail_for(self, data):
+        """Return detail level for an encoded page. Pages downscaled because
+        of sparse content are sent with low detail.
+        Args:
+            data (bytes): encoded page.
+
+        Returns:
+            str: detail level.
+        """
+        if not self.adaptive:
+            return self.detail
+        # only header is parsed
+        width, height = Image.open(io.BytesIO(data)).size
+        if width <= self.low_dimentions[0] and height <= self.low_dimentions[1]:
+            return 'low'
+        return self.detail
@@ -0,0 +1,77 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import os
+import json
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+class Journal:
+    """Append-only journal of processed reports stored as JSON lines. Each
+    line is written and flushed to disk as soon as the response for a
+    report is received, so that an interrupted run can be resumed.
+    """
+
+    def __init__(self, path):
+        # path of journal
+        self.path = path
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        # terminate incomplete last line left by a crash
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+    def entries(self):
+        """Iterate over entries of the journal without loading all of them.
+
+        Yields:
+            tuple: name of file of the report and list of its rows.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    # last line may be incomplete after a crash
+                    logger.warning('Skipped incomplete line in journal {}.', self.path)
+                    continue
+                yield entry['report'], entry['rows']
+
+    def load(self):
+        """Read rows of processed reports from the journal.
+
+        Returns:
+            dict: lists of rows keyed by names of files of the reports.
+        """
+        return dict(self.entries())
+
+    def reports(self):
+        """Return names of files of processed reports.
+
+        Returns:
+            set: names of files of the reports.
+        """
+        return {report for report, _ in self.entries()}
+
+    def append(self, report, rows):
+        """Add rows of a processed report to the journal.
+        Args:
+            report (str): Name of file of the report.
+            rows (list): Rows of the report as dictionaries.
+        """
+        line = json.dumps({'report': report, 'rows': rows}, default=str)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def reset(self):
+        """Remove all entries from the journal."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
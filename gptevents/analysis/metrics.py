@@ -0,0 +1,205 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+class Metrics:
+    """Timing spans of stages of processing reports, e.g. rasterisation,
+    encoding, waiting for the rate limiter and requests to GPT4-V, with page
+    counts and payload bytes. Spans are aggregated into histograms exported
+    as JSON and Prometheus text format, and throughput and ETA of the run
+    are reported while it progresses.
+    """
+    # upper bounds of buckets of histograms in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, math.inf)
+    # prefix of names of Prometheus metrics
+    prefix = 'gptevents'
+
+    def __init__(self, interval=60.0):
+        # time between reports of progress in seconds
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, total=0):
+        """Start new run.
+        Args:
+            total (int, optional): number of reports to process in the run.
+        """
+        with self.lock:
+            # durations of spans keyed by stage
+            self.durations = {}
+            # all spans with their report and fields
+            self.spans = []
+            # totals of the run
+            self.counters = {'reports': 0, 'pages': 0, 'payload_bytes': 0}
+            # number of reports to process
+            self.total = total
+            # start of run and of spans of reports in progress
+            self.start = time.monotonic()
+            self.started = {}
+            self.last_progress = self.start
+
+    def observe(self, stage, seconds, report=None, **fields):
+        """Record a span.
+        Args:
+            stage (str): name of stage.
+            seconds (float): duration of span.
+            report (str, optional): report of span.
+            fields: additional fields of span, e.g. pages and bytes.
+        """
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+            self.spans.append(dict(stage=stage, report=report, seconds=seconds, **fields))
+
+    @contextmanager
+    def span(self, stage, report=None, **fields):
+        """Measure duration of the enclosed block as a span. Fields can be
+        added to the yielded dictionary inside the block. Log records within
+        the block carry the stage and report.
+        Args:
+            stage (str): name of stage.
+            report (str, optional): report of span.
+            fields: additional fields of span.
+
+        Yields:
+            dict: fields of span.
+        """
+        context = {'stage': stage} if report is None else {'stage': stage, 'report': report}
+        start = time.perf_counter()
+        try:
+            with gpte.log_context(**context):
+                yield fields
+        finally:
+            self.observe(stage, time.perf_counter() - start, report, **fields)
+
+    def count(self, **values):
+        """Increase counters of the run, e.g. pages and payload_bytes."""
+        with self.lock:
+            for name, value in values.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def begin(self, report):
+        """Mark start of processing of a report."""
+        with self.lock:
+            self.started.setdefault(report, time.perf_counter())
+
+    def end(self, report):
+        """Mark end of processing of a report and report progress of the run
+        every interval seconds.
+        Args:
+            report (str): report.
+        """
+        with self.lock:
+            start = self.started.pop(report, None)
+            self.counters['reports'] += 1
+            now = time.monotonic()
+            progress = now - self.last_progress >= self.interval
+            if progress:
+                self.last_progress = now
+        if start is not None:
+            self.observe('report', time.perf_counter() - start, report)
+        if progress:
+            self.log_summary()
+
+    def summary(self):
+        """Return throughput of the run and estimated time to finish it.
+
+        Returns:
+            dict: summary of the run.
+        """
+        with self.lock:
+            elapsed = time.monotonic() - self.start
+            counters = dict(self.counters)
+        rate = counters['reports'] / elapsed if elapsed else 0.0
+        remaining = max(0, self.total - counters['reports'])
+        return dict(counters,
+                    total=self.total,
+                    elapsed=elapsed,
+                    reports_per_sec=rate,
+                    pages_per_sec=counters['pages'] / elapsed if elapsed else 0.0,
+                    eta=remaining / rate if rate else None)
+
+    def log_summary(self):
+        """Log throughput of the run and estimated time to finish it."""
+        summary = self.summary()
+        logger.info('Processed {} of {} reports in {:.1f} s: {:.2f} reports/s, {:.2f} pages/s, ETA {}.',
+                    summary['reports'], summary['total'], summary['elapsed'], summary['reports_per_sec'],
+                    summary['pages_per_sec'],
+                    '{:.0f} s'.format(summary['eta']) if summary['eta'] is not None else 'unknown')
+
+    def histograms(self):
+        """Aggregate spans into histograms.
+
+        Returns:
+            dict: histogram with cumulative counts of buckets, count, sum and
+                  percentiles keyed by stage.
+        """
+        with self.lock:
+            durations = {stage: sorted(values) for stage, values in self.durations.items()}
+        histograms = {}
+        for stage, values in durations.items():
+            cumulative = []
+            i = 0
+            for bound in self.buckets:
+                while i < len(values) and values[i] <= bound:
+                    i += 1
+                cumulative.append(i)
+            histograms[stage] = {'buckets': dict(zip(map(str, self.buckets), cumulative)),
+                                 'count': len(values),
+                                 'sum': sum(values),
+                                 'min': values[0],
+                                 'max': values[-1],
+                                 'p50': values[int(0.5 * (len(values) - 1))],
+                                 'p95': values[int(0.95 * (len(values) - 1))]}
+        return histograms
+
+    def to_json(self, path, spans=True):
+        """Export histograms, counters, summary and optionally spans as JSON.
+        Args:
+            path (str): path of file.
+            spans (bool, optional): include individual spans.
+        """
+        data = {'summary': self.summary(), 'histograms': self.histograms()}
+        if spans:
+            with self.lock:
+                data['spans'] = list(self.spans)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+        logger.debug('Saved metrics to {}.', path)
+
+    def to_prometheus(self, path=None):
+        """Export histograms and counters in Prometheus text format.
+        Args:
+            path (str, optional): path of file.
+
+        Returns:
+            str: metrics in Prometheus text format.
+        """
+        name = self.prefix + '_stage_seconds'
+        lines = ['# HELP {} Duration of stages of processing reports.'.format(name),
+                 '# TYPE {} histogram'.format(name)]
+        for stage, histogram in sorted(self.histograms().items()):
+            for bound, count in histogram['buckets'].items():
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                    name, stage, '+Inf' if bound == 'inf' else bound, count))
+            lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, histogram['sum']))
+            lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, histogram['count']))
+        with self.lock:
+            counters = dict(self.counters)
+        for counter, value in sorted(counters.items()):
+            lines.append('# TYPE {}_{}_total counter'.format(self.prefix, counter))
+            lines.append('{}_{}_total {}'.format(self.prefix, counter, value))
+        text = '\n'.join(lines) + '\n'
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+            logger.debug('Saved metrics to {}.', path)
+        return text
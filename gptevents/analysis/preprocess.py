@@ -0,0 +1,125 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import hashlib
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+class PagePreprocessor:
+    """Preprocessing of rasterised pages before encoding: near-blank pages
+    are dropped, white margins are cropped and, if dedupe is set, pages
+    repeated within a report, e.g. cover sheets and form instructions, are
+    skipped. Dedupe is exact: a page is only a duplicate if a digest of its
+    pixels equals that of a page sent before, so pages with the same layout
+    but different content are always kept, while scans of the same page
+    that differ in a few pixels, e.g. the same form scanned twice, are kept
+    as well. Objects are sent to worker processes, so they only hold plain
+    settings.
+    """
+
+    def __init__(self, drop_blank=True, blank_threshold=0.002, crop_margins=True, crop_threshold=230,
+                 crop_padding=20, dedupe=False):
+        # drop pages with almost no content
+        self.drop_blank = drop_blank
+        # fraction of dark pixels below which page is blank
+        self.blank_threshold = blank_threshold
+        # crop white margins of pages
+        self.crop_margins = crop_margins
+        # grey level below which pixels are content when cropping
+        self.crop_threshold = crop_threshold
+        # white border kept around content in pixels
+        self.crop_padding = crop_padding
+        # skip pages with the same pixels as a page sent before
+        self.dedupe = dedupe
+
+    def key(self):
+        """Return settings that change preprocessed pages, for keys of caches.
+
+        Returns:
+            dict: settings of preprocessor.
+        """
+        return {'blank_threshold': self.blank_threshold if self.drop_blank else None,
+                'crop_threshold': self.crop_threshold if self.crop_margins else None,
+                'crop_padding': self.crop_padding if self.crop_margins else None,
+                'digest': 'sha256' if self.dedupe else None}
+
+    def density(self, image):
+        """Return fraction of dark pixels on a downscaled grayscale copy of the
+        page.
+        Args:
+            image (PIL.Image): page.
+
+        Returns:
+            float: density of content between 0 and 1.
+        """
+        small = image.convert('L')
+        small.thumbnail((512, 512))
+        histogram = small.histogram()
+        return sum(histogram[:200]) / max(1, sum(histogram))
+
+    def crop(self, image):
+        """Crop white margins of the page, keeping crop_padding pixels around
+        content.
+        Args:
+            image (PIL.Image): page.
+
+        Returns:
+            PIL.Image: cropped page.
+        """
+        # mask of content, getbbox finds non-zero pixels
+        mask = image.convert('L').point(lambda p: 255 if p < self.crop_threshold else 0)
+        box = mask.getbbox()
+        if box is None:
+            return image
+        left, top, right, bottom = box
+        return image.crop((max(0, left - self.crop_padding),
+                           max(0, top - self.crop_padding),
+                           min(image.width, right + self.crop_padding),
+                           min(image.height, bottom + self.crop_padding)))
+
+    def digest(self, image):
+        """Return digest of the pixels of the page.
+        Args:
+            image (PIL.Image): page.
+
+        Returns:
+            str: SHA-256 of size and grayscale pixels of page.
+        """
+        gray = image.convert('L')
+        return hashlib.sha256(repr(gray.size).encode('ascii') + gray.tobytes()).hexdigest()
+
+    @staticmethod
+    def is_duplicate(value, seen):
+        """Check if a page has the same pixels as a page seen before.
+        Args:
+            value (str): digest of page.
+            seen (set): digests of pages seen before.
+
+        Returns:
+            bool: page is a duplicate.
+        """
+        return value is not None and value in seen
+
+    def process(self, image):
+        """Preprocess page.
+        Args:
+            image (PIL.Image): page.
+
+        Returns:
+            tuple: preprocessed page or None if page is blank, and statistics
+                   with keys blank, pixels_removed and hash, which holds
+                   digest of the page if dedupe is set.
+        """
+        stats = {'blank': False, 'pixels_removed': 0, 'hash': None}
+        if self.drop_blank and self.density(image) < self.blank_threshold:
+            stats['blank'] = True
+            stats['pixels_removed'] = image.width * image.height
+            return None, stats
+        if self.crop_margins:
+            cropped = self.crop(image)
+            stats['pixels_removed'] = image.width * image.height - cropped.width * cropped.height
+            image = cropped
+        if self.dedupe:
+            stats['hash'] = self.digest(image)
+        return image, stats
@@ -0,0 +1,206 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
+
+import gptevents as gpte
+from .encoder import PageEncoder
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+def page_ranges(n_pages, n_chunks):
+    """Split pages of a document into contiguous ranges.
+    Args:
+        n_pages (int): Number of pages in the document.
+        n_chunks (int): Maximum number of ranges.
+
+    Returns:
+        list: List of (first_page, last_page) tuples numbered from 1.
+    """
+    n_chunks = max(1, min(n_chunks, n_pages))
+    size, rest = divmod(n_pages, n_chunks)
+    ranges = []
+    first_page = 1
+    for i in range(n_chunks):
+        last_page = first_page + size - 1 + (1 if i < rest else 0)
+        ranges.append((first_page, last_page))
+        first_page = last_page + 1
+    return ranges
+
+
+def select_ranges(pages, n_chunks):
+    """Split selected pages of a document into contiguous ranges, splitting
+    the longest ranges until there are n_chunks of them.
+    Args:
+        pages (list): Numbers of pages starting from 1.
+        n_chunks (int): Minimum number of ranges if there are enough pages.
+
+    Returns:
+        list: List of (first_page, last_page) tuples in the order of pages.
+    """
+    ranges = []
+    for page in sorted(set(pages)):
+        if ranges and ranges[-1][1] == page - 1:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    while ranges and len(ranges) < n_chunks:
+        i = max(range(len(ranges)), key=lambda j: ranges[j][1] - ranges[j][0])
+        first_page, last_page = ranges[i]
+        if first_page == last_page:
+            break
+        middle = (first_page + last_page) // 2
+        ranges[i:i + 1] = [(first_page, middle), (middle + 1, last_page)]
+    return ranges
+
+
+def render_pages(full_path, first_page=None, last_page=None, resize_dimentions=None, dpi=200, encoder=None,
+                 preprocessor=None):
+    """Rasterise, preprocess and encode pages of a PDF file. Runs in worker
+    processes.
+    Args:
+        full_path (str): Path of the PDF file.
+        first_page (int, optional): First page to render, numbered from 1.
+        last_page (int, optional): Last page to render, numbered from 1.
+        resize_dimentions (tuple, optional): Maximum size of pages. Aspect
+                                             ratio is preserved.
+        dpi (int, optional): Resolution of rendering.
+        encoder (PageEncoder, optional): Encoder of pages. Defaults to PNG.
+        preprocessor (PagePreprocessor, optional): Preprocessor of pages.
+                                                   Pages are not preprocessed
+                                                   by default.
+
+    Returns:
+        list: List of pages as tuples of encoded bytes (empty for dropped
+              pages), size of page as PNG before encoding (None if not
+              measured) and information about the page: durations of
+              stages in seconds and statistics of preprocessing.
+    """
+    if encoder is None:
+        encoder = PageEncoder()
+    start = time.perf_counter()
+    images = convert_from_path(full_path, dpi=dpi, first_page=first_page, last_page=last_page)
+    # time of rasterisation is shared by pages of the range
+    raster = (time.perf_counter() - start) / max(1, len(images))
+    pages = []
+    for image in images:
+        info = {'raster': raster}
+        # drop blank pages and crop margins
+        if preprocessor is not None:
+            start = time.perf_counter()
+            image, stats = preprocessor.process(image)
+            info.update(stats, preprocess=time.perf_counter() - start)
+            if image is None:
+                pages.append((b'', None, info))
+                continue
+        # resize image with preserving the aspect ratio
+        if resize_dimentions:
+            start = time.perf_counter()
+            image.thumbnail(resize_dimentions, Image.Resampling.LANCZOS)
+            info['resize'] = time.perf_counter() - start
+        start = time.perf_counter()
+        data, baseline = encoder.encode(image)
+        info['encode'] = time.perf_counter() - start
+        pages.append((data, baseline, info))
+    return pages
+
+
+class RasterEngine:
+    """Rasterise PDF files to encoded pages, spreading pages and whole reports
+    over a pool of processes. With parallel=False pages are rendered
+    serially in the calling process.
+    """
+
+    def __init__(self, parallel=True, workers=None, encoder=None, preprocessor=None):
+        # use pool of processes
+        self.parallel = parallel
+        # encoder of pages
+        self.encoder = encoder or PageEncoder()
+        # preprocessor of pages, None to send pages as rendered
+        self.preprocessor = preprocessor
+        # number of processes, defaults to number of cores
+        self.workers = workers or os.cpu_count() or 1
+        # pool of processes, created on first use
+        self.pool = None
+
+    def _get_pool(self):
+        """Create pool of processes on first use."""
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            logger.debug('Started pool of {} processes for rasterisation.', self.workers)
+        return self.pool
+
+    def submit(self, full_path, resize_dimentions=None, dpi=200, pages=None):
+        """Submit pages of a PDF file to the pool of processes.
+        Args:
+            full_path (str): Path of the PDF file.
+            resize_dimentions (tuple, optional): Maximum size of pages.
+            dpi (int, optional): Resolution of rendering.
+            pages (list, optional): Numbers of pages to render. Defaults to
+                                    all pages.
+
+        Returns:
+            list: List of futures in the order of pages.
+        """
+        if pages is None:
+            ranges = page_ranges(pdfinfo_from_path(full_path)['Pages'], self.workers)
+        else:
+            ranges = select_ranges(pages, self.workers)
+        pool = self._get_pool()
+        return [pool.submit(render_pages, full_path, first_page, last_page, resize_dimentions, dpi,
+                            self.encoder, self.preprocessor)
+                for first_page, last_page in ranges]
+
+    def render(self, full_path, resize_dimentions=None, dpi=200, pages=None):
+        """Rasterise pages of a PDF file.
+        Args:
+            full_path (str): Path of the PDF file.
+            resize_dimentions (tuple, optional): Maximum size of pages.
+            dpi (int, optional): Resolution of rendering.
+            pages (list, optional): Numbers of pages to render. Defaults to
+                                    all pages.
+
+        Returns:
+            list: List of pages as tuples of encoded bytes, size before
+                  encoding and information about the page in the order
+                  of pages.
+        """
+        return self.start(full_path, resize_dimentions, dpi, pages)()
+
+    def start(self, full_path, resize_dimentions=None, dpi=200, pages=None):
+        """Start rasterising pages of a PDF file in the pool of processes. In
+        serial mode pages are rasterised when the result is requested.
+        Args:
+            full_path (str): Path of the PDF file.
+            resize_dimentions (tuple, optional): Maximum size of pages.
+            dpi (int, optional): Resolution of rendering.
+            pages (list, optional): Numbers of pages to render. Defaults to
+                                    all pages.
+
+        Returns:
+            function: function without arguments returning list of pages as
+                      tuples of encoded bytes, size before encoding and
+                      information about the page.
+        """
+        if not self.parallel:
+            return lambda: self._render_serial(full_path, resize_dimentions, dpi, pages)
+        futures = self.submit(full_path, resize_dimentions, dpi, pages)
+        return lambda: [page for future in futures for page in future.result()]
+
+    def _render_serial(self, full_path, resize_dimentions, dpi, pages):
+        """Rasterise pages of a PDF file in the calling process."""
+        if pages is None:
+            return render_pages(full_path, resize_dimentions=resize_dimentions, dpi=dpi, encoder=self.encoder,
+                                preprocessor=self.preprocessor)
+        return [page for first_page, last_page in select_ranges(pages, 1)
+                for page in render_pages(full_path, first_page, last_page, resize_dimentions, dpi, self.encoder,
+                                         self.preprocessor)]
+
+    def shutdown(self):
+        """Stop pool of processes."""
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
@@ -0,0 +1,206 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import re
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+import openai
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+# errors after which the request is sent again
+RETRYABLE_ERRORS = (openai.RateLimitError,
+                    openai.APITimeoutError,
+                    openai.APIConnectionError,
+                    openai.InternalServerError)
+
+
+def parse_duration(value):
+    """Turn duration from headers of OpenAI into seconds, e.g. '1s', '6m0s',
+    '20ms' or '2.5'.
+    Args:
+        value (str): duration.
+
+    Returns:
+        float: duration in seconds or None if it cannot be parsed.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def estimate_tokens(content, max_tokens):
+    """Estimate number of tokens used by a request for limiting tokens per
+    minute: about 4 characters per token of text, a fixed cost per image and
+    the maximum length of the response.
+    Args:
+        content (list): content of the message.
+        max_tokens (int): maximum number of tokens in response.
+
+    Returns:
+        int: estimated number of tokens.
+    """
+    tokens = max_tokens
+    for item in content:
+        if item['type'] == 'text':
+            tokens += len(item['text']) // 4 + 1
+        else:
+            # 2048x2048 image scaled to 768x768 is 4 tiles of 170 tokens and 85 base tokens
+            tokens += 765 if item['image_url'].get('detail', 'high') != 'low' else 85
+    return tokens
+
+
+def is_retryable(error):
+    """Check if request that failed with error should be sent again.
+    Args:
+        error (Exception): error raised by the client.
+
+    Returns:
+        bool: request can be retried.
+    """
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class RateLimiter:
+    """Client-side limiter of requests and estimated tokens per minute shared
+    by all requests of a run. Limits reported by the server in rate-limit and
+    Retry-After headers pause all requests until they reset. Failed requests
+    are retried with capped exponential backoff with full jitter.
+    """
+    # length of window for limits in seconds
+    window = 60.0
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_retries=8,
+                 base_delay=1.0, max_delay=60.0):
+        # maximum number of requests per minute
+        self.requests_per_minute = requests_per_minute
+        # maximum number of estimated tokens per minute
+        self.tokens_per_minute = tokens_per_minute
+        # maximum number of retries of a request
+        self.max_retries = max_retries
+        # delay before first retry in seconds
+        self.base_delay = base_delay
+        # maximum delay between retries in seconds
+        self.max_delay = max_delay
+        # requests sent in the window as (time, tokens)
+        self.sent = deque()
+        # no requests are sent until this time
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        """Reserve capacity for a request.
+        Args:
+            tokens (int): estimated number of tokens of request.
+
+        Returns:
+            float: time to wait before trying again, 0 if capacity was reserved.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            # forget requests outside of window
+            while self.sent and self.sent[0][0] <= now - self.window:
+                self.sent.popleft()
+            wait = 0.0
+            if self.requests_per_minute and len(self.sent) >= self.requests_per_minute:
+                wait = self.sent[0][0] + self.window - now
+            if self.tokens_per_minute and self.sent:
+                used = sum(sent_tokens for _, sent_tokens in self.sent)
+                if used + tokens > self.tokens_per_minute:
+                    # wait until enough tokens leave the window
+                    for sent_time, sent_tokens in self.sent:
+                        used -= sent_tokens
+                        if used + tokens <= self.tokens_per_minute:
+                            break
+                    wait = max(wait, sent_time + self.window - now)
+            if wait > 0:
+                return wait
+            self.sent.append((now, tokens))
+            return 0.0
+
+    def acquire(self, tokens=0):
+        """Block until the request can be sent.
+        Args:
+            tokens (int, optional): estimated number of tokens of request.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            logger.debug('Rate limiter waiting {:.2f} s.', wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """Wait without blocking the event loop until the request can be sent.
+        Args:
+            tokens (int, optional): estimated number of tokens of request.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            logger.debug('Rate limiter waiting {:.2f} s.', wait)
+            await asyncio.sleep(wait)
+
+    def block(self, seconds):
+        """Pause all requests.
+        Args:
+            seconds (float): duration of pause.
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """Pause requests if headers of a response report exhausted limits.
+        Args:
+            headers (dict): headers of response.
+        """
+        if headers is None:
+            return
+        for limit in ('requests', 'tokens'):
+            remaining = headers.get('x-ratelimit-remaining-' + limit)
+            reset = parse_duration(headers.get('x-ratelimit-reset-' + limit))
+            if remaining is not None and reset and remaining.strip() == '0':
+                logger.debug('Limit of {} exhausted, pausing for {:.2f} s.', limit, reset)
+                self.block(reset)
+
+    def backoff(self, attempt, error=None):
+        """Return delay before retrying a failed request. Retry-After headers
+        of the error are honoured, otherwise capped exponential backoff with
+        full jitter is used.
+        Args:
+            attempt (int): number of failed attempts so far, starting at 0.
+            error (Exception, optional): error raised by the client.
+
+        Returns:
+            float: delay in seconds.
+        """
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+        if headers is not None:
+            retry_after = headers.get('retry-after-ms')
+            if retry_after is not None and parse_duration(retry_after) is not None:
+                delay = parse_duration(retry_after) / 1000
+            else:
+                delay = parse_duration(headers.get('retry-after'))
+            if delay is not None and 0 < delay <= 10 * self.max_delay:
+                # all requests wait for limit to reset
+                if isinstance(error, openai.RateLimitError):
+                    self.block(delay)
+                return delay
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
@@ -0,0 +1,143 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import json
+import numpy as np
+import pandas as pd
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+# types of collisions in reports
+COLLISION_TYPES = ['rear_end', 'sideswipe', 'head_on', 'broadside', 'pedestrian', 'cyclist', 'object', 'other',
+                   'none']
+# levels of injuries in reports
+INJURY_LEVELS = ['none', 'minor', 'moderate', 'major', 'fatal', 'unknown']
+
+# JSON schema of responses about an event, fields that are not given in the report are null
+EVENT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'av_at_fault': {'type': ['boolean', 'null'],
+                        'description': 'Whether the automated vehicle was at fault.'},
+        'collision_type': {'type': 'string', 'enum': COLLISION_TYPES,
+                           'description': 'Type of the collision.'},
+        'speed_mph': {'type': ['number', 'null'],
+                      'description': 'Speed of the automated vehicle at the time of the collision in mph.'},
+        'injuries': {'type': 'string', 'enum': INJURY_LEVELS,
+                     'description': 'Most severe injury in the event.'},
+        'summary': {'type': 'string',
+                    'description': 'Short description of the event.'},
+    },
+    'required': ['av_at_fault', 'collision_type', 'speed_mph', 'injuries', 'summary'],
+    'additionalProperties': False,
+}
+
+
+def response_format(name='event', schema=None):
+    """Return response format of a request asking for a response following
+    the JSON schema.
+    Args:
+        name (str, optional): name of schema.
+        schema (dict, optional): JSON schema, EVENT_SCHEMA by default.
+
+    Returns:
+        dict: response format.
+    """
+    return {'type': 'json_schema',
+            'json_schema': {'name': name, 'strict': True, 'schema': schema or EVENT_SCHEMA}}
+
+
+def _loads(response):
+    """Parse one response, None if it is not a JSON object."""
+    try:
+        value = json.loads(response)
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _nullable(field):
+    """Return True if field may be null."""
+    kinds = EVENT_SCHEMA['properties'][field]['type']
+    return isinstance(kinds, list) and 'null' in kinds
+
+
+def _flag(errors, mask, message):
+    """Append message to errors of rows in mask."""
+    if not mask.any():
+        return errors
+    return errors.where(~mask, errors.where(errors == '', errors + '; ') + message)
+
+
+def parse_responses(responses):
+    """Parse responses following EVENT_SCHEMA into typed columns. All
+    responses are decoded in one call and rows are only decoded one by one
+    if some of them are not valid JSON. Fields are validated column by column
+    and invalid values are set to missing. Rows with invalid responses are
+    flagged in column structured_error instead of being requested again.
+    Args:
+        responses (series): responses.
+
+    Returns:
+        dataframe: columns of fields with the index of responses, and
+                   columns structured_valid and structured_error.
+    """
+    if responses.empty:
+        return pd.DataFrame({'av_at_fault': pd.Series(dtype='boolean'),
+                             'collision_type': pd.Categorical([], categories=COLLISION_TYPES),
+                             'speed_mph': pd.Series(dtype='Float64'),
+                             'injuries': pd.Categorical([], categories=INJURY_LEVELS),
+                             'summary': pd.Series(dtype=object),
+                             'structured_valid': pd.Series(dtype=bool),
+                             'structured_error': pd.Series(dtype=object)},
+                            index=responses.index)
+    texts = responses.where(responses.notna(), '').astype(str)
+    # decode all responses at once if each of them looks like one object, most of them are valid
+    stripped = texts.str.strip()
+    try:
+        if not (stripped.str.startswith('{') & stripped.str.endswith('}')).all():
+            raise ValueError('responses are not one JSON object each')
+        values = json.loads('[' + ','.join(stripped.tolist()) + ']')
+        if len(values) != len(texts) or not all(isinstance(value, dict) for value in values):
+            raise ValueError('responses are not one JSON object each')
+    except ValueError:
+        values = [_loads(text) for text in texts.tolist()]
+    parsed = np.array([value is not None for value in values], dtype=bool)
+    fields = pd.DataFrame.from_records([value or {} for value in values], columns=EVENT_SCHEMA['required'])
+    fields.index = responses.index
+    errors = pd.Series(np.where(parsed, '', 'not a JSON object'), index=responses.index, dtype=object)
+    # missing fields of parsed responses
+    for field in EVENT_SCHEMA['required']:
+        if not _nullable(field):
+            errors = _flag(errors, parsed & fields[field].isna(), 'missing ' + field)
+    # booleans, null allowed
+    valid = fields['av_at_fault'].isna() | (fields['av_at_fault'].map(type) == bool)
+    errors = _flag(errors, parsed & ~valid, 'invalid av_at_fault')
+    av_at_fault = fields['av_at_fault'].where(valid & fields['av_at_fault'].notna()).astype('boolean')
+    # categories from enums
+    collision_type = pd.Categorical(fields['collision_type'].where(fields['collision_type'].map(type) == str),
+                                    categories=COLLISION_TYPES)
+    errors = _flag(errors, parsed & fields['collision_type'].notna() & pd.isna(collision_type),
+                   'invalid collision_type')
+    injuries = pd.Categorical(fields['injuries'].where(fields['injuries'].map(type) == str),
+                              categories=INJURY_LEVELS)
+    errors = _flag(errors, parsed & fields['injuries'].notna() & pd.isna(injuries), 'invalid injuries')
+    # non-negative numbers, null allowed, booleans are not numbers
+    kinds = fields['speed_mph'].map(type)
+    speed = pd.to_numeric(fields['speed_mph'].where(kinds.isin([int, float])), errors='coerce')
+    valid = fields['speed_mph'].isna() | (speed >= 0)
+    errors = _flag(errors, parsed & ~valid, 'invalid speed_mph')
+    speed_mph = speed.where(valid).astype('Float64')
+    # text
+    valid = fields['summary'].map(type) == str
+    errors = _flag(errors, parsed & fields['summary'].notna() & ~valid, 'invalid summary')
+    summary = fields['summary'].where(valid)
+    df = pd.DataFrame({'av_at_fault': av_at_fault,
+                       'collision_type': collision_type,
+                       'speed_mph': speed_mph,
+                       'injuries': injuries,
+                       'summary': summary},
+                      index=responses.index)
+    df['structured_valid'] = errors == ''
+    df['structured_error'] = errors.where(errors != '')
+    return df
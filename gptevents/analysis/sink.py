@@ -0,0 +1,78 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import os
+import csv
+import pandas as pd
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+def read_csv(path, columns, dtype=None, **kwargs):
+    """Read CSV file with rows without losing text. Columns read as str keep
+    their values as written, e.g. N/A, None, empty strings and numbers in
+    responses, and only empty values of other columns are missing.
+    Args:
+        path (str): path of CSV file.
+        columns (list): Columns of rows.
+        dtype (dict, optional): Types of columns, str for columns with text.
+        **kwargs: other arguments of pd.read_csv.
+
+    Returns:
+        dataframe: dataframe with rows or iterator over chunks.
+    """
+    dtype = dtype or {}
+    na_values = {column: [''] for column in columns if dtype.get(column) is not str}
+    return pd.read_csv(path, dtype=dtype, keep_default_na=False, na_values=na_values, **kwargs)
+
+
+class CsvSink:
+    """Sink that appends rows with results to a CSV file as they arrive, so
+    that results do not need to be kept in memory while reports are
+    processed. The dataframe is built once from the file at the end, or
+    read lazily in chunks.
+    """
+
+    def __init__(self, path, columns):
+        # path of CSV file
+        self.path = path
+        # columns of rows, missing values are left empty
+        self.columns = list(columns)
+        # number of rows written
+        self.n_rows = 0
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+    def reset(self):
+        """Start new file with header only."""
+        with open(self.path, 'w', newline='', encoding='utf-8') as f:
+            csv.DictWriter(f, fieldnames=self.columns).writeheader()
+        self.n_rows = 0
+
+    def append(self, rows):
+        """Append rows to the file.
+        Args:
+            rows (list): Rows as dictionaries.
+        """
+        if not os.path.exists(self.path):
+            self.reset()
+        with open(self.path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns, extrasaction='ignore')
+            writer.writerows(rows)
+        self.n_rows += len(rows)
+
+    def read(self, chunksize=None, usecols=None, dtype=None):
+        """Read rows from the file.
+        Args:
+            chunksize (int, optional): Return an iterator over dataframes with
+                                       that many rows instead of one dataframe.
+            usecols (list, optional): Columns to read.
+            dtype (dict, optional): Types of columns, str for columns with
+                                    text that is read as written.
+
+        Returns:
+            dataframe: dataframe with rows or iterator over chunks.
+        """
+        if not os.path.exists(self.path):
+            self.reset()
+        return read_csv(self.path, self.columns, chunksize=chunksize, usecols=usecols, dtype=dtype)
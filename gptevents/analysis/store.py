@@ -0,0 +1,151 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import os
+import glob
+import pandas as pd
+
+import gptevents as gpte
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, pickle files are used without it
+    pa = None
+    pq = None
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+class ParquetStore:
+    """Columnar storage of data as a folder of Parquet files, each holding a
+    partition of rows. New reports are appended as a new partition without
+    rewriting the stored rows; if a report is stored in several partitions,
+    its rows from the newest partition are read. Columns can be read without
+    reading the others and files are memory-mapped. Unlike pickle files,
+    the files can be shared between machines safely. Needs pyarrow.
+    """
+    # pattern of names of files of partitions
+    pattern = 'part-{:05d}.parquet'
+
+    def __init__(self, path, max_partitions=32):
+        if pq is None:
+            raise ImportError('Storage of data in Parquet files needs pyarrow. Install it with pip install pyarrow.')
+        # path of folder with partitions
+        self.path = path
+        # partitions are compacted into one when there are more of them
+        self.max_partitions = max_partitions
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    @staticmethod
+    def available():
+        """Return True if pyarrow is installed."""
+        return pq is not None
+
+    def partitions(self):
+        """Return paths of files of partitions from oldest to newest."""
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def _write_partition(self, df):
+        """Write rows as a new partition. The file is renamed into place once
+        it is complete, so readers never see partially written files.
+        Args:
+            df (dataframe): rows.
+
+        Returns:
+            str: path of file of partition.
+        """
+        partitions = self.partitions()
+        index = int(os.path.basename(partitions[-1])[5:10]) + 1 if partitions else 0
+        path = os.path.join(self.path, self.pattern.format(index))
+        path_tmp = os.path.join(self.path, '.' + self.pattern.format(index) + '.tmp')
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path_tmp)
+        os.replace(path_tmp, path)
+        return path
+
+    def write(self, df):
+        """Replace stored rows with rows of dataframe.
+        Args:
+            df (dataframe): rows.
+        """
+        old = self.partitions()
+        self._write_partition(df)
+        for path in old:
+            os.remove(path)
+        logger.info('Saved {} rows to {}.', df.shape[0], self.path)
+
+    def append(self, df):
+        """Append rows as a new partition, compacting partitions if there are
+        more than max_partitions of them.
+        Args:
+            df (dataframe): rows.
+        """
+        if df.empty:
+            return
+        self._write_partition(df)
+        logger.info('Appended {} rows to {}.', df.shape[0], self.path)
+        if len(self.partitions()) > self.max_partitions:
+            self.write(self.read(memory_map=False))
+
+    def reports(self):
+        """Return names of stored reports, reading only their column.
+
+        Returns:
+            set: names of files of reports.
+        """
+        reports = set()
+        for path in self.partitions():
+            if 'report' in pq.read_schema(path).names:
+                reports.update(pq.read_table(path, columns=['report']).column('report').to_pylist())
+        return reports
+
+    @staticmethod
+    def changed(df, stored):
+        """Find rows of reports that are not stored or whose rows differ from
+        the stored rows, comparing hashes of values of rows.
+        Args:
+            df (dataframe): rows.
+            stored (dataframe): stored rows with the same columns.
+
+        Returns:
+            series: True for rows of changed reports.
+        """
+        columns = sorted(df.columns)
+
+        def fingerprints(rows):
+            # hashes of rows of each report, independent of their order
+            hashes = pd.util.hash_pandas_object(rows[columns], index=False)
+            return hashes.groupby(rows['report'].values).agg(lambda values: tuple(sorted(values)))
+
+        old = fingerprints(stored)
+        new = fingerprints(df)
+        same = new.index.isin(old.index)
+        same[same] = new[same].values == old.reindex(new.index[same]).values
+        return ~df['report'].isin(new.index[same])
+
+    def read(self, columns=None, memory_map=True):
+        """Read stored rows.
+        Args:
+            columns (list, optional): Columns to read, all columns if not given.
+            memory_map (bool, optional): Memory-map files instead of reading them.
+
+        Returns:
+            dataframe: stored rows.
+        """
+        frames = []
+        for i, path in enumerate(self.partitions()):
+            names = pq.read_schema(path).names
+            # reports are needed to keep the rows from the newest partition
+            needed = names if columns is None else [name for name in names if name in columns or name == 'report']
+            df = pq.read_table(path, columns=needed, memory_map=memory_map).to_pandas()
+            df['_partition'] = i
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True)
+        # keep rows of each report from the newest partition
+        if len(frames) > 1 and 'report' in df:
+            df = df[df['_partition'] == df.groupby('report')['_partition'].transform('max')]
+        df = df.drop(columns='_partition').reset_index(drop=True)
+        if columns is not None:
+            df = df[[column for column in columns if column in df]]
+        return df
@@ -0,0 +1,171 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import time
+import asyncio
+import httpx
+import openai
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+class StreamDeadlineError(openai.APITimeoutError):
+    """Streamed response missed a deadline. Retried like other timeouts."""
+
+    def __init__(self, request, deadline, seconds):
+        openai.APIConnectionError.__init__(self,
+                                           message='Stream missed {} deadline of {:.1f} s.'.format(deadline, seconds),
+                                           request=request)
+        # deadline that was missed: first_token, stall or total
+        self.deadline = deadline
+
+
+class StreamDeadlines:
+    """Deadlines of streamed requests to GPT4-V: connecting to the server,
+    receiving the first token and receiving the whole response. Waiting for
+    the next chunk of the stream is bounded by the read timeout of the
+    request, so a stream that stalls after its first token is cancelled too.
+    """
+
+    def __init__(self, connect=10.0, first_token=60.0, total=300.0):
+        # maximum time to connect to the server in seconds
+        self.connect = connect
+        # maximum time from sending the request to the first token in seconds
+        self.first_token = first_token
+        # maximum time of the whole request in seconds
+        self.total = total
+
+    def timeout(self):
+        """Return timeout of httpx for a streamed request. Reads time out
+        after the shorter of the first-token and total deadlines without data.
+
+        Returns:
+            httpx.Timeout: timeout.
+        """
+        return httpx.Timeout(self.total, connect=self.connect, read=min(self.first_token, self.total))
+
+    def stalled(self, request, result):
+        """Return error for a stream without data within the read timeout.
+        Args:
+            request (httpx.Request): request.
+            result (StreamResult): content received so far.
+
+        Returns:
+            StreamDeadlineError: error.
+        """
+        if result.first_token_time is None:
+            return StreamDeadlineError(request, 'first_token', self.first_token)
+        return StreamDeadlineError(request, 'stall', min(self.first_token, self.total))
+
+    def check(self, request, start, first_token_time):
+        """Raise if a deadline was missed.
+        Args:
+            request (httpx.Request): request.
+            start (float): time of sending the request.
+            first_token_time (float): time of the first token or None.
+        """
+        now = time.monotonic()
+        if first_token_time is None and now - start > self.first_token:
+            raise StreamDeadlineError(request, 'first_token', self.first_token)
+        if now - start > self.total:
+            raise StreamDeadlineError(request, 'total', self.total)
+
+
+class StreamResult:
+    """Content of a streamed response with its timing."""
+
+    def __init__(self, start):
+        # time of sending the request
+        self.start = start
+        # time of first token, None until it arrives
+        self.first_token_time = None
+        # received parts of content
+        self.parts = []
+        # number of chunks with content, about one token each
+        self.tokens = 0
+        # time of end of the stream
+        self.end = None
+
+    def add(self, chunk):
+        """Add chunk of the stream."""
+        if not chunk.choices:
+            return
+        content = chunk.choices[0].delta.content
+        if content:
+            if self.first_token_time is None:
+                self.first_token_time = time.monotonic()
+            self.parts.append(content)
+            self.tokens += 1
+
+    @property
+    def content(self):
+        """Whole content of the response."""
+        return ''.join(self.parts)
+
+    @property
+    def ttft(self):
+        """Time to first token in seconds."""
+        return None if self.first_token_time is None else self.first_token_time - self.start
+
+    @property
+    def tokens_per_sec(self):
+        """Tokens per second after the first token."""
+        if self.first_token_time is None or self.end is None or self.end <= self.first_token_time:
+            return None
+        return self.tokens / (self.end - self.first_token_time)
+
+
+def consume_stream(stream, deadlines, start):
+    """Read a streamed response, cancelling it when a deadline is missed.
+    Args:
+        stream (openai.Stream): stream of chunks.
+        deadlines (StreamDeadlines): deadlines of the request.
+        start (float): time of sending the request.
+
+    Returns:
+        StreamResult: content and timing of the response.
+    """
+    result = StreamResult(start)
+    try:
+        for chunk in stream:
+            result.add(chunk)
+            deadlines.check(stream.response.request, start, result.first_token_time)
+    except httpx.TimeoutException:
+        # no data within the read timeout
+        raise deadlines.stalled(stream.response.request, result)
+    finally:
+        stream.close()
+    result.end = time.monotonic()
+    return result
+
+
+async def consume_stream_async(stream, deadlines, start):
+    """Read a streamed response without blocking the event loop, cancelling
+    it when a deadline is missed.
+    Args:
+        stream (openai.AsyncStream): stream of chunks.
+        deadlines (StreamDeadlines): deadlines of the request.
+        start (float): time of sending the request.
+
+    Returns:
+        StreamResult: content and timing of the response.
+    """
+    result = StreamResult(start)
+
+    async def read():
+        async for chunk in stream:
+            result.add(chunk)
+            deadlines.check(stream.response.request, start, result.first_token_time)
+
+    try:
+        # the total deadline is enforced exactly by cancelling the read
+        await asyncio.wait_for(read(), timeout=max(0.0, deadlines.total - (time.monotonic() - start)))
+    except httpx.TimeoutException:
+        # no data within the read timeout
+        raise deadlines.stalled(stream.response.request, result)
+    except asyncio.TimeoutError:
+        raise StreamDeadlineError(stream.response.request, 'total', deadlines.total)
+    finally:
+        await stream.close()
+    result.end = time.monotonic()
+    return result
@@ -0,0 +1,97 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import re
+import subprocess
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+def extract_text(full_path, timeout=60):
+    """Extract embedded text of each page of a PDF file with pdftotext from
+    poppler, which is already required by pdf2image.
+    Args:
+        full_path (str): Path of the PDF file.
+        timeout (float, optional): Maximum time for extraction in seconds.
+
+    Returns:
+        list: text of each page in the order of pages.
+    """
+    result = subprocess.run(['pdftotext', '-layout', '-enc', 'UTF-8', full_path, '-'],
+                            capture_output=True, timeout=timeout, check=True)
+    pages = result.stdout.decode('utf-8', errors='replace').split('\f')
+    # output ends with a form feed after the last page
+    if pages and not pages[-1].strip():
+        pages = pages[:-1]
+    return pages
+
+
+def pages_with_images(full_path, min_pixels=300 * 300, timeout=60):
+    """Return pages with embedded images of at least min_pixels pixels, i.e.
+    scanned pages and pages with figures, using pdfimages from poppler.
+    Args:
+        full_path (str): Path of the PDF file.
+        min_pixels (int, optional): Minimum size of image in pixels.
+        timeout (float, optional): Maximum time for listing in seconds.
+
+    Returns:
+        set: numbers of pages starting from 1.
+    """
+    result = subprocess.run(['pdfimages', '-list', full_path],
+                            capture_output=True, timeout=timeout, check=True)
+    pages = set()
+    # skip header and separator line of the table
+    for line in result.stdout.decode('utf-8', errors='replace').splitlines()[2:]:
+        fields = line.split()
+        try:
+            page, width, height = int(fields[0]), int(fields[3]), int(fields[4])
+        except (IndexError, ValueError):
+            continue
+        if width * height >= min_pixels:
+            pages.add(page)
+    return pages
+
+
+def usable_text(text, min_chars=200, min_ratio=0.9):
+    """Check if text layer of a page can be sent instead of its image: it has
+    enough characters and is mostly readable, i.e. not produced by broken
+    font encodings.
+    Args:
+        text (str): text of page.
+        min_chars (int, optional): minimum number of non-whitespace characters.
+        min_ratio (float, optional): minimum fraction of letters, digits and
+                                     common punctuation.
+
+    Returns:
+        bool: text is usable.
+    """
+    chars = re.sub(r'\s', '', text)
+    if len(chars) < min_chars:
+        return False
+    readable = sum(1 for char in chars if char.isalnum() or char in '.,;:!?()[]-/\'"%$&#@*+=')
+    return readable / len(chars) >= min_ratio
+
+
+def text_pages(full_path, min_chars=200, min_ratio=0.9, min_pixels=300 * 300):
+    """Return text of pages of a PDF file that have a usable text layer and no
+    large embedded images. Other pages need to be rasterised.
+    Args:
+        full_path (str): Path of the PDF file.
+        min_chars (int, optional): minimum number of characters on page.
+        min_ratio (float, optional): minimum fraction of readable characters.
+        min_pixels (int, optional): minimum size of images making a page
+                                    scanned or figure-heavy.
+
+    Returns:
+        tuple: number of pages and dictionary of texts keyed by numbers of
+               pages starting from 1.
+    """
+    try:
+        texts = extract_text(full_path)
+        images = pages_with_images(full_path, min_pixels)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning('Could not read text layer of {}, sending all pages as images: {}.', full_path, e)
+        return None, {}
+    pages = {i + 1: text.strip() for i, text in enumerate(texts)
+             if i + 1 not in images and usable_text(text, min_chars, min_ratio)}
+    return len(texts), pages
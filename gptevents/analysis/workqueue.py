@@ -0,0 +1,208 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import os
+import glob
+import time
+import socket
+import sqlite3
+from contextlib import closing
+import pandas as pd
+
+import gptevents as gpte
+from .sink import read_csv
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+
+class WorkQueue:
+    """Queue of reports shared by workers on several machines through a
+    SQLite database on a shared filesystem. Each report is leased by one
+    worker at a time; leases of workers that stopped expire and the reports
+    are claimed again by other workers. Claims run in exclusive transactions
+    with the rollback journal, which works on network filesystems with
+    working file locks, unlike WAL. Each worker streams its results to its
+    own CSV file in a folder next to the database that belongs to this
+    queue only, and rows of reports that are done are merged when all
+    reports are done, taking the rows of the worker that completed them.
+    Leases use wall-clock time, so clocks of machines need to be roughly in
+    sync compared to lease_seconds.
+    """
+    # statuses of reports
+    statuses = ('pending', 'leased', 'done', 'failed')
+
+    def __init__(self, path, worker_id=None, lease_seconds=600.0, max_attempts=3, poll_interval=30.0):
+        # path of database on shared filesystem
+        self.path = path
+        # id of this worker, unique across machines
+        self.worker_id = worker_id or '{}-{}'.format(socket.gethostname(), os.getpid())
+        # duration of leases in seconds
+        self.lease_seconds = lease_seconds
+        # number of attempts after which report is marked as failed
+        self.max_attempts = max_attempts
+        # time between checks for reports leased by other workers in seconds
+        self.poll_interval = poll_interval
+        # folder with results of workers of this queue
+        self.dir_partial = os.path.abspath(self.path) + '.partial'
+        if not os.path.exists(self.dir_partial):
+            os.makedirs(self.dir_partial)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS reports ('
+                         'report TEXT PRIMARY KEY, status TEXT NOT NULL, worker TEXT, '
+                         'lease_until REAL, attempts INTEGER NOT NULL, updated REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS reports_status ON reports (status, lease_until)')
+
+    def _connect(self):
+        """Open connection to database with transactions started explicitly."""
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = DELETE')
+        return closing(conn)
+
+    @property
+    def file_partial(self):
+        """Path of CSV file with results of this worker."""
+        return os.path.join(self.dir_partial, 'data_{}.csv'.format(self.worker_id))
+
+    def add(self, reports):
+        """Add reports to the queue. Reports already in the queue are kept.
+        Args:
+            reports (list): names of files of reports.
+
+        Returns:
+            int: number of added reports.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            added = conn.executemany('INSERT OR IGNORE INTO reports VALUES (?, ?, NULL, NULL, 0, ?)',
+                                     ((report, 'pending', now) for report in reports)).rowcount
+            conn.execute('COMMIT')
+        logger.info('Added {} reports to work queue {}.', added, self.path)
+        return added
+
+    def claim(self, n=1):
+        """Lease pending reports and reports with expired leases.
+        Args:
+            n (int, optional): maximum number of reports.
+
+        Returns:
+            list: names of files of leased reports.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # exclusive transaction, so that each report is claimed by one worker
+            conn.execute('BEGIN IMMEDIATE')
+            # reports whose workers stopped too often are not claimed again
+            conn.execute("UPDATE reports SET status = 'failed', worker = NULL, lease_until = NULL, updated = ? "
+                         "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                         (now, now, self.max_attempts))
+            reports = [report for report, in conn.execute(
+                "SELECT report FROM reports WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?) "
+                "ORDER BY report LIMIT ?", (now, n))]
+            conn.executemany("UPDATE reports SET status = 'leased', worker = ?, lease_until = ?, "
+                             "attempts = attempts + 1, updated = ? WHERE report = ?",
+                             ((self.worker_id, now + self.lease_seconds, now, report) for report in reports))
+            conn.execute('COMMIT')
+        if reports:
+            logger.debug('Worker {} leased {} reports.', self.worker_id, len(reports))
+        return reports
+
+    def renew(self, reports):
+        """Extend leases of reports held by this worker.
+        Args:
+            reports (list): names of files of reports.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany("UPDATE reports SET lease_until = ?, updated = ? "
+                             "WHERE report = ? AND worker = ? AND status = 'leased'",
+                             ((now + self.lease_seconds, now, report, self.worker_id) for report in reports))
+            conn.execute('COMMIT')
+
+    def complete(self, report):
+        """Mark report leased by this worker as done.
+        Args:
+            report (str): name of file of report.
+
+        Returns:
+            bool: lease was still held by this worker.
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            held = conn.execute("UPDATE reports SET status = 'done', lease_until = NULL, updated = ? "
+                                "WHERE report = ? AND worker = ? AND status = 'leased'",
+                                (time.time(), report, self.worker_id)).rowcount == 1
+            conn.execute('COMMIT')
+        if not held:
+            logger.warning('Lease of report {} expired before it was completed by worker {}.', report,
+                           self.worker_id)
+        return held
+
+    def fail(self, report):
+        """Return report leased by this worker to the queue, or mark it as
+        failed after max_attempts attempts.
+        Args:
+            report (str): name of file of report.
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("UPDATE reports SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                         "worker = NULL, lease_until = NULL, updated = ? "
+                         "WHERE report = ? AND worker = ? AND status = 'leased'",
+                         (self.max_attempts, time.time(), report, self.worker_id))
+            conn.execute('COMMIT')
+
+    def counts(self):
+        """Return number of reports with each status.
+
+        Returns:
+            dict: numbers of reports keyed by status.
+        """
+        with self._connect() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM reports GROUP BY status').fetchall())
+        return {status: counts.get(status, 0) for status in self.statuses}
+
+    def unfinished(self):
+        """Return number of reports that are pending or leased."""
+        counts = self.counts()
+        return counts['pending'] + counts['leased']
+
+    def completed(self):
+        """Return workers that completed reports that are done.
+
+        Returns:
+            dict: ids of workers keyed by names of files of reports.
+        """
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT report, worker FROM reports WHERE status = 'done'").fetchall())
+
+    def merge(self, columns, dtype=None):
+        """Merge results of all workers for reports that are done. If a
+        report was processed by several workers after its lease expired, rows
+        of the worker that completed it are kept.
+        Args:
+            columns (list): Columns of rows.
+            dtype (dict, optional): Types of columns, str for columns with
+                                    text that is read as written.
+
+        Returns:
+            dataframe: results of all workers.
+        """
+        completed = self.completed()
+        frames = []
+        for i, path in enumerate(sorted(glob.glob(os.path.join(self.dir_partial, 'data_*.csv')))):
+            df = read_csv(path, columns, usecols=columns, dtype=dtype)
+            df['_worker'] = os.path.basename(path)[len('data_'):-len('.csv')]
+            df['_order'] = i
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True)
+        # keep only reports that are done in this queue
+        df = df[df['report'].isin(completed)]
+        # keep rows of worker that completed the lease, or of the first worker if it has no rows
+        preferred = df['_worker'] == df['report'].map(completed)
+        has_preferred = preferred.groupby(df['report']).transform('any')
+        first = df['_order'] == df.groupby('report')['_order'].transform('min')
+        df = df[preferred | (~has_preferred & first)]
+        logger.info('Merged results of {} reports from {} workers.', df['report'].nunique(), len(frames))
+        return df.drop(columns=['_worker', '_order']).reset_index(drop=True)
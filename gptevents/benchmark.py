@@ -0,0 +1,316 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import os
+import sys
+import json
+import time
+import types
+import platform
+import tempfile
+import subprocess
+import datetime as dt
+from PIL import Image, ImageDraw
+
+import gptevents as gpte
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+# const
+PAGE_COUNTS = [1, 5, 20]  # numbers of pages of synthetic reports
+REPORTS_PER_SIZE = 3  # number of synthetic reports of each size
+REPEAT = 3  # number of repetitions of each stage, best wall time is reported
+LATENCY = 0.0  # latency of mocked GPT4-V in seconds
+PARALLEL_RASTER = True  # rasterise pages of reports in a pool of processes
+COMPARE_WITH = None  # path of earlier results to compare with, e.g. from another commit
+REGRESSION_THRESHOLD = 0.1  # relative drop of pages per second reported as regression
+IMPORT_BUDGET = 0.5  # maximum time of import of gptevents in a fresh interpreter in seconds
+# modules that import of gptevents should not load
+HEAVY_MODULES = ['matplotlib', 'plotly', 'pandas', 'openai', 'pdf2image', 'PIL']
+
+
+class MockClient:
+    """Stand-in for openai.OpenAI answering chat completions with a fixed
+    response after a fixed latency, for measuring the pipeline without
+    calling the API.
+    """
+
+    def __init__(self, latency=0.0, response='No events found.'):
+        # latency of each request in seconds
+        self.latency = latency
+        # content of each response
+        self.response = response
+        # number of requests received
+        self.n_requests = 0
+        completions = types.SimpleNamespace(create=lambda **kwargs: self._create(**kwargs).parse())
+        completions.with_raw_response = types.SimpleNamespace(create=self._create)
+        self.chat = types.SimpleNamespace(completions=completions)
+
+    def _create(self, **kwargs):
+        """Answer request in the form of a raw response."""
+        self.n_requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        message = types.SimpleNamespace(content=self.response)
+        response = types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+        return types.SimpleNamespace(headers={}, parse=lambda: response)
+
+
+def make_report(path, n_pages, size=(1700, 2200)):
+    """Write a synthetic scanned report: each page is an image with lines of
+    text, like reports of events submitted to DMV.
+    Args:
+        path (str): Path of the PDF file.
+        n_pages (int): Number of pages.
+        size (tuple, optional): Size of pages in pixels at 200 DPI.
+    """
+    pages = []
+    for i in range(n_pages):
+        image = Image.new('RGB', size, 'white')
+        draw = ImageDraw.Draw(image)
+        draw.text((150, 100), 'REPORT OF TRAFFIC COLLISION INVOLVING AN AUTONOMOUS VEHICLE', fill='black')
+        for y in range(200, size[1] - 200, 24):
+            draw.text((150, y), 'Page {} line {}: the automated vehicle was travelling at {} mph. '.format(
+                i + 1, y, y % 40) * 2, fill='black')
+        pages.append(image)
+    pages[0].save(path, 'PDF', save_all=True, append_images=pages[1:], resolution=200)
+
+
+def make_reports(path, page_counts=PAGE_COUNTS, reports_per_size=REPORTS_PER_SIZE):
+    """Write synthetic reports of varying numbers of pages.
+    Args:
+        path (str): Folder of reports.
+        page_counts (list, optional): Numbers of pages of reports.
+        reports_per_size (int, optional): Number of reports of each size.
+
+    Returns:
+        dict: numbers of pages keyed by names of files.
+    """
+    reports = {}
+    for n_pages in page_counts:
+        for i in range(reports_per_size):
+            file = 'report_{}p_{}.pdf'.format(n_pages, i + 1)
+            make_report(os.path.join(path, file), n_pages)
+            reports[file] = n_pages
+    logger.info('Wrote {} synthetic reports with {} pages.', len(reports), sum(reports.values()))
+    return reports
+
+
+def peak_rss():
+    """Return peak resident set size of this process and its finished child
+    processes in MB. The peak only grows, so it is the high-water mark up to
+    now.
+
+    Returns:
+        float: peak RSS in MB or None if not available.
+    """
+    if resource is None:
+        return None
+    rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss +
+           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # bytes on macOS, kilobytes elsewhere
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def measure(stage, function, n_pages, repeat=REPEAT):
+    """Run a stage repeatedly and measure it.
+    Args:
+        stage (str): Name of stage.
+        function (function): Function without arguments running the stage.
+        n_pages (int): Number of pages processed by one run of the stage.
+        repeat (int, optional): Number of runs, best wall time is reported.
+
+    Returns:
+        dict: results of the stage.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    result = {'stage': stage,
+              'pages': n_pages,
+              'wall_time': min(times),
+              'wall_times': times,
+              'pages_per_sec': n_pages / min(times) if min(times) else None,
+              'peak_rss_mb': peak_rss()}
+    logger.info('{}: {:.3f} s, {:.1f} pages/s, peak RSS {} MB.', stage, result['wall_time'],
+                result['pages_per_sec'] or 0, result['peak_rss_mb'])
+    return result
+
+
+def measure_import(budget=IMPORT_BUDGET, repeat=REPEAT):
+    """Measure time of import of gptevents in fresh interpreters, like in a
+    worker process or a command-line invocation, and check that no heavy
+    modules are loaded by it.
+    Args:
+        budget (float, optional): Maximum time of import in seconds.
+        repeat (int, optional): Number of runs, best time is reported.
+
+    Returns:
+        dict: results of the stage.
+    """
+    code = ('import sys, time, json\n'
+            't = time.perf_counter()\n'
+            'import gptevents\n'
+            'print(json.dumps([time.perf_counter() - t, [m for m in {} if m in sys.modules]]))').format(HEAVY_MODULES)
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=gpte.settings.root_dir, capture_output=True,
+                                check=True, text=True).stdout
+        seconds, heavy_modules = json.loads(output.strip().splitlines()[-1])
+        times.append(seconds)
+    result = {'stage': 'import',
+              'pages': 0,
+              'wall_time': min(times),
+              'wall_times': times,
+              'pages_per_sec': None,
+              'peak_rss_mb': peak_rss(),
+              'budget': budget,
+              'heavy_modules': heavy_modules,
+              'within_budget': min(times) <= budget and not heavy_modules}
+    logger.info('import: {:.3f} s (budget {:.3f} s).', result['wall_time'], budget)
+    if not result['within_budget']:
+        logger.warning('Import of gptevents exceeds budget of {:.3f} s or loads heavy modules {}.',
+                       budget, heavy_modules)
+    return result
+
+
+def git_commit():
+    """Return hash of current commit of the repository or None."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=gpte.settings.root_dir, capture_output=True,
+                              check=True, text=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(page_counts=PAGE_COUNTS, reports_per_size=REPORTS_PER_SIZE, repeat=REPEAT, latency=LATENCY,
+                  parallel_raster=PARALLEL_RASTER):
+    """Measure stages of the pipeline on synthetic reports with mocked GPT4-V.
+    Caches are off and all files are written to a temporary folder.
+    Args:
+        page_counts (list, optional): Numbers of pages of reports.
+        reports_per_size (int, optional): Number of reports of each size.
+        repeat (int, optional): Number of runs of each stage.
+        latency (float, optional): Latency of mocked GPT4-V in seconds.
+        parallel_raster (bool, optional): Rasterise pages in a pool of processes.
+
+    Returns:
+        dict: results of the benchmark.
+    """
+    output_dir = gpte.settings.output_dir
+    with tempfile.TemporaryDirectory() as path:
+        dir_reports = os.path.join(path, 'reports')
+        os.makedirs(dir_reports)
+        reports = make_reports(dir_reports, page_counts, reports_per_size)
+        n_pages = sum(reports.values())
+        # keep journal and streamed results of the benchmark away from real runs
+        gpte.settings.output_dir = os.path.join(path, 'output')
+        try:
+            chatgpt = gpte.analysis.ChatGPT(files_reports=dir_reports, save_p=False, load_p=False, save_csv=False,
+                                            parallel_raster=parallel_raster, response_cache=False,
+                                            page_cache=False, api_key='benchmark')
+            chatgpt.gpt_client = MockClient(latency=latency)
+            # startup of worker processes and scripts
+            stages = [measure_import(repeat=repeat)]
+            # rasterisation, resizing and encoding of pages to base64
+            stages.append(measure('pdf_to_base64_image',
+                                  lambda: [chatgpt.pdf_to_base64_image(file, resize_image=True,
+                                                                       resize_dimentions=chatgpt.resize_dimentions)
+                                           for file in reports],
+                                  n_pages, repeat))
+            # encoding of rendered pages to base64
+            rendered = [page[0] for file in reports
+                        for page in chatgpt.raster.render(os.path.join(dir_reports, file),
+                                                          chatgpt.resize_dimentions, chatgpt.dpi)]
+            stages.append(measure('encode_image', lambda: [chatgpt.encode_image(page) for page in rendered],
+                                  n_pages, repeat))
+            # building and sending requests to mocked GPT4-V
+            pages = {file: chatgpt.pdf_to_base64_image(file, resize_image=True,
+                                                       resize_dimentions=chatgpt.resize_dimentions)
+                     for file in reports}
+            stages.append(measure('ask_gptv', lambda: [chatgpt.ask_gptv(file, pages[file]) for file in reports],
+                                  n_pages, repeat))
+            # whole pipeline
+            stages.append(measure('read_data',
+                                  lambda: chatgpt.read_data(filter_data=False, clean_data=False, analyse_data=False),
+                                  n_pages, repeat))
+            chatgpt.raster.shutdown()
+        finally:
+            gpte.settings.output_dir = output_dir
+    return {'commit': git_commit(),
+            'time': dt.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'params': {'page_counts': list(page_counts),
+                       'reports_per_size': reports_per_size,
+                       'repeat': repeat,
+                       'latency': latency,
+                       'parallel_raster': parallel_raster},
+            'stages': stages}
+
+
+def save_results(results, path=None):
+    """Save results of the benchmark as JSON.
+    Args:
+        results (dict): results of the benchmark.
+        path (str, optional): Path of the file. Defaults to a file named after
+                              time and commit in the benchmark output folder.
+
+    Returns:
+        str: path of the file.
+    """
+    if path is None:
+        folder = os.path.join(gpte.settings.output_dir, 'benchmark')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        path = os.path.join(folder, 'benchmark_{}_{}.json'.format(
+            dt.datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S'), (results['commit'] or 'unknown')[:8]))
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info('Saved results of benchmark to {}.', path)
+    return path
+
+
+def compare_results(old, new, threshold=REGRESSION_THRESHOLD):
+    """Compare pages per second of stages between two results of the
+    benchmark.
+    Args:
+        old (dict): earlier results.
+        new (dict): current results.
+        threshold (float, optional): relative drop reported as regression.
+
+    Returns:
+        list: names of stages with regressions.
+    """
+    old_stages = {stage['stage']: stage for stage in old['stages']}
+    regressions = []
+    for stage in new['stages']:
+        # budget of import time is absolute
+        if 'within_budget' in stage and not stage['within_budget']:
+            regressions.append(stage['stage'])
+        before = old_stages.get(stage['stage'], {}).get('pages_per_sec')
+        after = stage['pages_per_sec']
+        if not before or not after:
+            continue
+        change = after / before - 1
+        logger.info('{}: {:.1f} -> {:.1f} pages/s ({:+.1f}%).', stage['stage'], before, after, 100 * change)
+        if change < -threshold:
+            regressions.append(stage['stage'])
+    if regressions:
+        logger.warning('Regressions against commit {}: {}.', old.get('commit'), ', '.join(regressions))
+    return regressions
+
+
+if __name__ == '__main__':
+    gpte.logs(show_level='info', show_color=True)
+    results = run_benchmark()
+    save_results(results)
+    if COMPARE_WITH:
+        with open(COMPARE_WITH) as f:
+            compare_results(json.load(f), results)
@@ -3,7 +3,6 @@ from typing import Dict
 import os
 import json
 import pickle
-import sys
 
 import gptevents as gpte
 
@@ -21,58 +20,38 @@ def get_secrets(entry_name: str, secret_file_name: str = 'secret') -> Dict[str,
 def get_configs(entry_name: str, config_file_name: str = 'config',
                 config_default_file_name: str = 'default.config'):
     """
-    Open the config file and return the requested entry.
-    If no config file is found, open default.config.
+    Return the requested entry of the config file. Files are read and
+    validated once and shared by the package, see gptevents.config.Config.
+    If no config file is found, default.config is used. Raises ConfigError
+    if the config is invalid.
     """
-    # check if config file is updated
-    if not gpte.common.check_config():
-        sys.exit()
-    try:
-        with open(os.path.join(gpte.settings.root_dir, config_file_name)) as f:
-            content = json.load(f)
-    except FileNotFoundError:
-        with open(os.path.join(gpte.settings.root_dir, config_default_file_name)) as f:
-            content = json.load(f)
-    return content[entry_name]
+    return gpte.config.get_config(config_file_name, config_default_file_name).get(entry_name)
+
+
+class LazyConfig:
+    """
+    Class attribute with a value from the config file that is read on first
+    access instead of when the class is defined.
+    """
+
+    def __init__(self, entry_name: str):
+        self.entry_name = entry_name
+
+    def __get__(self, obj, owner=None):
+        return get_configs(self.entry_name)
 
 
 def check_config(config_file_name: str = 'config',
                  config_default_file_name: str = 'default.config'):
     """
-    Check if config file has at least as many rows as deault.config.
+    Check if config file has all entries of default.config with valid types.
     """
-    # load config file
-    try:
-        with open(os.path.join(gpte.settings.root_dir, config_file_name)) as f:
-            config = json.load(f)
-    except FileNotFoundError:
-        logger.error('Config file {} not found.', config_file_name)
-        return False
-    except json.decoder.JSONDecodeError:
-        logger.error('Config file badly formatted. Please update based on' +
-                     ' default.config.', config_file_name)
-        return False
-    # load default.config file
     try:
-        with open(os.path.join(gpte.settings.root_dir,
-                               config_default_file_name)) as f:
-            default = json.load(f)
-    except FileNotFoundError:
-        logger.error('Default config file {} not found.', config_file_name)
-        return False
-    except json.decoder.JSONDecodeError:
-        logger.error('Config file badly formatted. Please update based on' +
-                     ' default.config.', config_file_name)
-        return False
-    # check length of each file
-    if len(config) < len(default):
-        logger.error('Config file has {} variables, which is fewer than {}'
-                     + ' variables in default.config. Please update.',
-                     len(config),
-                     len(default))
+        gpte.config.Config(config_file_name, config_default_file_name).load()
+    except gpte.config.ConfigError as e:
+        logger.error('{}', e)
         return False
-    else:
-        return True
+    return True
 
 
 def search_dict(dictionary, search_for, nested=False):
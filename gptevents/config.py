@@ -0,0 +1,173 @@
+"""Configuration of the project loaded once from the config file."""
+import os
+import json
+import threading
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+# shared configurations keyed by names of config files
+_configs = {}
+_configs_lock = threading.Lock()
+
+
+class ConfigError(Exception):
+    """Config file is missing, badly formatted or has invalid entries."""
+
+
+class Config:
+    """Configuration of the project read from the config file, with entries
+    missing in it taken from default.config. Files are read and validated
+    once on first access and shared by the whole package. With reload=True
+    the files are read again when they change on disk. Entries are available
+    as attributes or with get(). Errors raise ConfigError.
+
+    Examples
+    --------
+    >>> config = Config()
+    >>> config.query
+    'Describe the accident in this report involving an automated vehicle...'
+    """
+    # types of entries in config files
+    types = {'reports': str,
+             'query': str,
+             'plotly_template': str}
+
+    def __init__(self, config_file_name='config', config_default_file_name='default.config', reload=False):
+        # path of config file
+        self.path = os.path.join(gpte.settings.root_dir, config_file_name)
+        # path of config file with defaults
+        self.default_path = os.path.join(gpte.settings.root_dir, config_default_file_name)
+        # read files again when they change
+        self.reload = reload
+        # validated entries, read on first access
+        self.values = None
+        # times of modification of files when they were read
+        self.mtimes = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # lock cannot be sent to worker processes
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name in type(self).types:
+            return self.get(name)
+        raise AttributeError('{!r} object has no attribute {!r}'.format(type(self).__name__, name))
+
+    def _mtimes(self):
+        """Return times of modification of config files, None if missing."""
+        mtimes = []
+        for path in (self.path, self.default_path):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    @staticmethod
+    def _read(path):
+        """Read config file.
+        Args:
+            path (str): path of file.
+
+        Returns:
+            dict: entries of file or None if file does not exist.
+        """
+        try:
+            with open(path) as f:
+                content = json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.decoder.JSONDecodeError as e:
+            raise ConfigError('Config file {} badly formatted: {}. Please update based on '
+                              'default.config.'.format(path, e)) from e
+        if not isinstance(content, dict):
+            raise ConfigError('Config file {} must contain a JSON object.'.format(path))
+        return content
+
+    def validate(self, content, default):
+        """Merge entries of config file with defaults and check them.
+        Args:
+            content (dict): entries of config file or None if it is missing.
+            default (dict): entries of default.config.
+
+        Returns:
+            dict: validated entries.
+        """
+        if content is None:
+            logger.warning('Config file {} not found, using {}.', self.path, self.default_path)
+            content = {}
+        # config file needs to have all entries of default.config
+        missing = [entry for entry in default if entry not in content]
+        if missing and content:
+            raise ConfigError('Config file {} misses entries {} of default.config. Please update.'.format(
+                self.path, ', '.join(missing)))
+        values = dict(default, **content)
+        for entry, entry_type in self.types.items():
+            if entry not in values:
+                raise ConfigError('Entry {} is missing in {} and {}.'.format(entry, self.path, self.default_path))
+            if not isinstance(values[entry], entry_type):
+                raise ConfigError('Entry {} in config file must be of type {}, not {}.'.format(
+                    entry, entry_type.__name__, type(values[entry]).__name__))
+        return values
+
+    def load(self):
+        """Read and validate config files.
+
+        Returns:
+            dict: validated entries.
+        """
+        with self.lock:
+            mtimes = self._mtimes()
+            default = self._read(self.default_path)
+            if default is None:
+                raise ConfigError('Default config file {} not found.'.format(self.default_path))
+            self.values = self.validate(self._read(self.path), default)
+            self.mtimes = mtimes
+            logger.debug('Loaded config from {}.', self.path)
+            return self.values
+
+    def get(self, entry_name):
+        """Return entry of config.
+        Args:
+            entry_name (str): name of entry.
+
+        Returns:
+            value of entry.
+        """
+        values = self.values
+        if values is None or (self.reload and self._mtimes() != self.mtimes):
+            values = self.load()
+        try:
+            return values[entry_name]
+        except KeyError:
+            raise ConfigError('Entry {} not found in config.'.format(entry_name)) from None
+
+
+def get_config(config_file_name='config', config_default_file_name='default.config', reload=None):
+    """Return configuration shared by the package.
+    Args:
+        config_file_name (str, optional): name of config file.
+        config_default_file_name (str, optional): name of config file with defaults.
+        reload (bool, optional): read files again when they change. Keeps
+                                 current setting if not given.
+
+    Returns:
+        Config: configuration.
+    """
+    key = (config_file_name, config_default_file_name)
+    with _configs_lock:
+        config = _configs.get(key)
+        if config is None:
+            config = _configs[key] = Config(config_file_name, config_default_file_name, bool(reload))
+        elif reload is not None:
+            config.reload = reload
+    return config
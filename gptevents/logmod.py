@@ -1,12 +1,23 @@
 """Contain function to display or store logging messages."""
 import logging
+import logging.handlers
 import sys
 import os
+import json
+import queue
+import atexit
+import contextvars
 import datetime as dt
+from contextlib import contextmanager
 from typing import Union, Optional
 
 import gptevents as gpte
 
+# fields such as report and stage added to log records of the current context
+_context = contextvars.ContextVar('gptevents_log_context', default={})
+# listener writing records from the queue in queue mode
+_listener = None
+
 
 def logs(
         show_level: Optional[Union[int, str]] = None,
@@ -15,7 +26,9 @@ def logs(
         path: Optional[str] = None,
         threads: bool = False,
         multiproc: bool = False,
-        show_color: bool = True
+        show_color: bool = True,
+        use_queue: bool = False,
+        json_lines: bool = False
 ) -> None:
     """
     Initialize the logger.
@@ -40,12 +53,21 @@ def logs(
     show_color : bool, default True
         If you have the coloredlogs package installed the messages will be
         colored.
+    use_queue : bool, default False
+        Put records on a queue and write them to the console and to disk in
+        a background thread, keeping logging I/O off the hot path.
+    json_lines : bool, default False
+        Store logs on disk as JSON lines with report and stage fields set
+        with `log_context`.
 
     Note that log levels can be one of the listed strings or an integer between
     1 and 100. If you want to get all possible log messages, use a log level of
     1.
     """
     logger_root = logging.getLogger()
+    # stop listener of earlier call
+    stop_logs()
+    handlers_before = list(logger_root.handlers)
     fmt_items = ('%(asctime)s',
                  '%(levelname)-8s',
                  '%(threadName)s' if threads else None,
@@ -78,14 +100,109 @@ def logs(
         log_filename = 'log_{}_{}.log'.format(program_name, date_str)
         if path is None:
             path = gpte.settings.log_dir
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if json_lines:
+            log_filename = os.path.splitext(log_filename)[0] + '.jsonl'
         file_handler = logging.FileHandler(filename=os.path.join(path,
                                                                  log_filename))
-        file_handler.setFormatter(formatter)
+        file_handler.setFormatter(JsonFormatter() if json_lines else formatter)
         file_handler.setLevel(_convert_logging_level(save_level))
         logger_root.addHandler(file_handler)
+    # handlers added by this call, including the one of coloredlogs
+    handlers = [handler for handler in logger_root.handlers
+                if handler not in handlers_before]
+    if use_queue and handlers:
+        global _listener
+        # move handlers behind a queue served by a background thread
+        log_queue = queue.SimpleQueue()
+        for handler in handlers:
+            logger_root.removeHandler(handler)
+        _listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        # context is read in the thread that logs
+        queue_handler.addFilter(ContextFilter())
+        logger_root.addHandler(queue_handler)
+    else:
+        for handler in handlers:
+            handler.addFilter(ContextFilter())
     _logging_level_threshold()
 
 
+def stop_logs() -> None:
+    """
+    Stop the background listener of queue mode after writing all records in
+    the queue. Called automatically at exit.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        logger_root = logging.getLogger()
+        for handler in list(logger_root.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                logger_root.removeHandler(handler)
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logs)
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Add fields, e.g. report and stage, to all log records emitted within the
+    block in the current thread or asyncio task.
+
+    Examples
+    --------
+    >>> with log_context(report='report.pdf', stage='request'):
+    ...     logger.info('Sending request.')
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Filter adding fields of `log_context` to log records."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in _context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatter writing each record as one line of JSON with time, level,
+    logger, process, thread, message and fields of `log_context` such as
+    report and stage.
+    """
+    # attributes of log records that are not extra fields
+    reserved = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': dt.datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'process': record.processName,
+                 'thread': record.threadName,
+                 'message': record.getMessage()}
+        # fields of log_context and extra arguments
+        for name, value in vars(record).items():
+            if name not in self.reserved:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
 def _logging_level_threshold():
     """
     Set the level threshold for a couple of internal and external modules.
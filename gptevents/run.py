@@ -3,38 +3,83 @@ import matplotlib.pyplot as plt
 import matplotlib._pylab_helpers
 import gptevents as gpte
 
-gpte.logs(show_level='info', show_color=True)
+gpte.logs(show_level='info', show_color=True, use_queue=True)
 logger = gpte.CustomLogger(__name__)  # use custom logger
 
 # const
 SAVE_P = True  # save pickle files with data
 LOAD_P = False  # load pickle files with data
 SAVE_CSV = True  # load csv files with data
+STORAGE = 'parquet'  # save data as Parquet files ('parquet', needs pyarrow) or pickle file ('pickle')
+LOAD_COLUMNS = None  # columns to load with LOAD_P, None for all columns
 FILTER_DATA = True  # filter GPT4-V and heroku data
 CLEAN_DATA = True  # clean GPT4-V data
 ANALYSE_DATA = True  # analyse GPT4-V data
 SHOW_OUTPUT = True  # should figures be plotted
+ASYNC_MODE = False  # process reports concurrently
+MAX_CONCURRENCY = 8  # maximum number of reports processed at the same time
+PARALLEL_RASTER = True  # rasterise pages of reports in a pool of processes
+SAVE_PAGES = False  # save images of pages for debugging
+RESPONSE_CACHE = True  # reuse responses for reports that did not change
+PAGE_CACHE = True  # reuse rasterised pages of reports that did not change
+RESUME = False  # resume interrupted run, skipping reports that already have a response
+REQUESTS_PER_MINUTE = None  # client-side limit of requests per minute, None for no limit
+TOKENS_PER_MINUTE = None  # client-side limit of estimated tokens per minute, None for no limit
+BATCH_MODE = False  # send reports as asynchronous batch jobs, e.g. for nightly reprocessing
+PAGE_FORMAT = 'PNG'  # format of pages sent to GPT4-V: PNG, JPEG or WEBP
+PAGE_QUALITY = 85  # quality of JPEG and WEBP pages
+PAGE_MODE = 'RGB'  # colour mode of pages: RGB, L (grayscale) or 1 (black and white)
+ADAPTIVE_PAGES = False  # send sparse pages at lower resolution with low detail
+MEASURE_PAYLOAD = False  # report size of payload before and after encoding
+TEXT_LAYER = False  # send text of born-digital pages instead of images
+PREPROCESS_PAGES = True  # drop blank pages and crop margins
+DEDUPE_PAGES = False  # also skip pages with the same pixels as an earlier page of the same report
+BASE_URL = None  # base URL of API, e.g. 'http://127.0.0.1:8000/v1' for the stand-in server in standin.py
+# queries asked for each report keyed by names, with responses in columns response_<name>, e.g.
+# {'fault': 'Was the automated vehicle at fault?', 'weather': 'What was the weather?'}. Pages are
+# rasterised once per report. None for the query from config with responses in column response
+QUERIES = None
+STRUCTURED_OUTPUT = False  # ask for responses following JSON schema and parse them into columns
+STREAM = False  # stream responses and retry requests missing the first-token or total deadline
+PLOTLY_OUTPUT = 'shared'  # html files with one shared plotly.js ('shared'), one file for all ('dashboard') or 'inline'
+COMPRESS_DASHBOARD = False  # save dashboard as gzipped html file
+WORK_QUEUE = None  # path of queue on a shared filesystem for sharing reports between machines, None for one machine
 
 
 if __name__ == '__main__':
     # create object for working with heroku data
     reports = gpte.common.get_configs('reports')
-    chatgpt = gpte.analysis.ChatGPT(files_reports=reports, save_p=SAVE_P, load_p=LOAD_P, save_csv=SAVE_CSV)
+    encoder = gpte.analysis.PageEncoder(fmt=PAGE_FORMAT, quality=PAGE_QUALITY, mode=PAGE_MODE,
+                                        adaptive=ADAPTIVE_PAGES, measure=MEASURE_PAYLOAD)
+    preprocessor = gpte.analysis.PagePreprocessor(dedupe=DEDUPE_PAGES) if PREPROCESS_PAGES else None
+    chatgpt = gpte.analysis.ChatGPT(files_reports=reports, save_p=SAVE_P, load_p=LOAD_P, save_csv=SAVE_CSV,
+                                    async_mode=ASYNC_MODE, max_concurrency=MAX_CONCURRENCY,
+                                    parallel_raster=PARALLEL_RASTER, save_pages=SAVE_PAGES,
+                                    response_cache=RESPONSE_CACHE, page_cache=PAGE_CACHE,
+                                    resume=RESUME, requests_per_minute=REQUESTS_PER_MINUTE,
+                                    tokens_per_minute=TOKENS_PER_MINUTE, batch_mode=BATCH_MODE,
+                                    encoder=encoder, text_layer=TEXT_LAYER, preprocessor=preprocessor,
+                                    base_url=BASE_URL, stream=STREAM, work_queue=WORK_QUEUE,
+                                    storage=STORAGE, load_columns=LOAD_COLUMNS,
+                                    structured_output=STRUCTURED_OUTPUT, queries=QUERIES)
     # read heroku data
     data = chatgpt.read_data(filter_data=FILTER_DATA, clean_data=CLEAN_DATA, analyse_data=ANALYSE_DATA)
     logger.info('Data from {} reports included in analysis.', data.shape[0])
     if SHOW_OUTPUT:
         # Output
-        analysis = gpte.analysis.Analysis()
+        analysis = gpte.analysis.Analysis(plotly_output=PLOTLY_OUTPUT, compress=COMPRESS_DASHBOARD)
         logger.info('Creating figures.')
         # some bar plot
         analysis.bar(data, y=['report'], pretty_text=True, save_file=True)
         # some scatter plot
-        analysis.scatter(data, x='report', y='response', color='report', pretty_text=True, save_file=True)
+        analysis.scatter(data, x='report', y=chatgpt.response_columns()[0], color='report', pretty_text=True,
+                         save_file=True)
         # # some histogram
         analysis.hist(data, x=['report'],  pretty_text=True, save_file=True)
         # # some map
         # analysis.map(data, color='', save_file=True)
+        # save figures collected for dashboard
+        analysis.save_dashboard()
         # check if any figures are to be rendered
         figures = [manager.canvas.figure
                    for manager in
@@ -0,0 +1,520 @@
+# by Pavlo Bazilinskyy <pavlo.bazilinskyy@gmail.com> and Linghan Zhang
+import json
+import time
+import hashlib
+import uuid
+import random
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gptevents as gpte
+
+logger = gpte.CustomLogger(__name__)  # use custom logger
+
+# const
+HOST = '127.0.0.1'  # address of server
+PORT = 8000  # port of server, ChatGPT then needs base_url='http://127.0.0.1:8000/v1'
+LATENCY = 1.0  # mean latency of responses in seconds
+JITTER = 0.5  # latency varies uniformly by up to this many seconds
+RATE_429 = 0.05  # fraction of requests answered with 429 and Retry-After
+RATE_5XX = 0.02  # fraction of requests answered with 500 or 503
+RATE_TIMEOUT = 0.0  # fraction of requests that hang for TIMEOUT_DELAY seconds
+TIMEOUT_DELAY = 30.0  # duration of hanging requests in seconds
+TOKEN_DELAY = 0.01  # time between tokens of streamed responses in seconds
+RATE_STALL = 0.0  # fraction of streamed responses that stall for TIMEOUT_DELAY seconds after the first token
+RATE_MALFORMED = 0.0  # fraction of structured responses that are cut off
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Handler of requests to the stand-in server."""
+    # keep connections of clients alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        """Log requests with the custom logger instead of stderr."""
+        logger.debug('{} {}', self.address_string(), format % args)
+
+    def send_json(self, status, body, headers=None):
+        """Send response with JSON body.
+        Args:
+            status (int): status code.
+            body (dict): body of response.
+            headers (dict, optional): additional headers.
+        """
+        self.send_bytes(status, json.dumps(body).encode('utf-8'), 'application/json', headers)
+
+    def send_bytes(self, status, data, content_type, headers=None):
+        """Send response with raw body.
+        Args:
+            status (int): status code.
+            data (bytes): body of response.
+            content_type (str): type of body.
+            headers (dict, optional): additional headers.
+        """
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # client gave up, e.g. after its timeout
+            pass
+
+    def send_not_found(self, message=None):
+        """Send 404 for unknown endpoints and objects."""
+        self.send_json(404, self.server.standin.error(message or 'Unknown endpoint {}.'.format(self.path),
+                                                      'invalid_request_error'))
+
+    def do_GET(self):
+        """Return counters of the server, files and batches."""
+        standin = self.server.standin
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts[-1] == 'stats':
+            self.send_json(200, standin.stats())
+        # content of file, e.g. output of batch
+        elif len(parts) >= 3 and parts[-3] == 'files' and parts[-1] == 'content':
+            data = standin.file_content(parts[-2])
+            if data is None:
+                self.send_not_found('No file with id {}.'.format(parts[-2]))
+            else:
+                self.send_bytes(200, data, 'application/octet-stream')
+        elif len(parts) >= 2 and parts[-2] in ('files', 'batches'):
+            with standin.lock:
+                found = (standin.files if parts[-2] == 'files' else standin.batches).get(parts[-1])
+                found = dict(found) if found is not None else None
+            if found is None:
+                self.send_not_found('No object with id {}.'.format(parts[-1]))
+            else:
+                self.send_json(200, found)
+        else:
+            self.send_not_found()
+
+    def do_POST(self):
+        """Answer chat completions, uploads of files and creation of batches."""
+        standin = self.server.standin
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        path = self.path.split('?')[0].rstrip('/')
+        if path.endswith('/files'):
+            self.upload(body)
+            return
+        if not path.endswith('/chat/completions') and not path.endswith('/batches'):
+            self.send_not_found()
+            return
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self.send_json(400, standin.error('Body is not valid JSON.', 'invalid_request_error'))
+            return
+        if path.endswith('/batches'):
+            self.send_json(*standin.create_batch(request))
+            return
+        status, body, headers = standin.complete(request)
+        if status == 200 and request.get('stream'):
+            self.send_stream(body)
+        else:
+            self.send_json(status, body, headers)
+
+    def upload(self, body):
+        """Store file uploaded as multipart form data.
+        Args:
+            body (bytes): body of request.
+        """
+        standin = self.server.standin
+        header = 'Content-Type: {}\r\n\r\n'.format(self.headers.get('Content-Type', '')).encode('latin-1')
+        form = BytesParser(policy=HTTP).parsebytes(header + body)
+        fields = {}
+        if form.is_multipart():
+            for part in form.iter_parts():
+                fields[part.get_param('name', header='content-disposition')] = part
+        if 'file' not in fields:
+            self.send_json(400, standin.error('Missing file in upload.', 'invalid_request_error'))
+            return
+        purpose = fields['purpose'].get_payload(decode=True).decode('utf-8') if 'purpose' in fields else 'batch'
+        self.send_json(200, standin.upload(fields['file'].get_filename() or 'file', purpose,
+                                           fields['file'].get_payload(decode=True)))
+
+    def send_stream(self, body):
+        """Send completion as server-sent events of chunks, one per token.
+        Args:
+            body (dict): completion.
+        """
+        standin = self.server.standin
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            # end of stream is marked by closing the connection
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            stall = standin.stalls()
+            for i, chunk in enumerate(standin.chunks(body)):
+                self.wfile.write('data: {}\n\n'.format(json.dumps(chunk)).encode('utf-8'))
+                self.wfile.flush()
+                # stream stops after first token until client gives up
+                if stall and i == 1:
+                    time.sleep(standin.timeout_delay)
+                elif standin.token_delay:
+                    time.sleep(standin.token_delay)
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # client gave up, e.g. after its deadline
+            pass
+
+
+class StandInServer:
+    """Local server speaking the chat-completions API of OpenAI for testing
+    and load-testing ChatGPT offline. Requests with text and multiple images
+    are answered with a templated response after configurable latency, and
+    faults are injected at configurable rates: 429 with Retry-After, 500 and
+    503 errors, requests that hang to trigger timeouts of the client and
+    streamed responses that stall after the first token.
+    The files and batches endpoints are served too, so that batches are
+    answered offline: each request of an uploaded input file is answered by
+    complete() in a background thread, faults included, and the results are
+    stored as the output file of the batch.
+    Point ChatGPT to it with base_url=server.url.
+    """
+    # template of responses, filled with model, n_images, n_texts and request_id
+    template = 'No events found in report with {n_images} pages ({request_id}).'
+    # template of responses to requests with a JSON schema as response format
+    template_json = ('{{"av_at_fault": false, "collision_type": "rear_end", "speed_mph": {n_images}, '
+                     '"injuries": "none", "summary": "Report with {n_images} pages ({request_id})."}}')
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1.0,
+                 rate_5xx=0.0, rate_timeout=0.0, timeout_delay=30.0, token_delay=0.0, rate_stall=0.0,
+                 rate_malformed=0.0, template=None, seed=None):
+        # address of server
+        self.host = host
+        # port of server, 0 for any free port
+        self.port = port
+        # mean latency of responses in seconds
+        self.latency = latency
+        # latency varies uniformly by up to jitter seconds
+        self.jitter = jitter
+        # fraction of requests answered with 429
+        self.rate_429 = rate_429
+        # value of Retry-After header of 429 responses in seconds
+        self.retry_after = retry_after
+        # fraction of requests answered with 500 or 503
+        self.rate_5xx = rate_5xx
+        # fraction of requests that hang for timeout_delay seconds before being answered
+        self.rate_timeout = rate_timeout
+        # duration of hanging requests in seconds
+        self.timeout_delay = timeout_delay
+        # time between tokens of streamed responses in seconds
+        self.token_delay = token_delay
+        # fraction of streamed responses that stall after the first token
+        self.rate_stall = rate_stall
+        # fraction of responses to requests with a JSON schema that are cut off
+        self.rate_malformed = rate_malformed
+        # template of responses
+        if template is not None:
+            self.template = template
+        # generator of faults and latency, seeded for repeatable runs
+        self.random = random.Random(seed)
+        # counters of requests
+        self.counts = {'requests': 0, 'completed': 0, '429': 0, '5xx': 0, 'timeout': 0, 'stall': 0, 'malformed': 0,
+                       'images': 0, 'cached_tokens': 0}
+        self.lock = threading.Lock()
+        # hashes of prefixes of prompts seen before, served from cache like by OpenAI
+        self.prefixes = set()
+        # uploaded and created files by id, and their content
+        self.files = {}
+        self.contents = {}
+        # batches by id
+        self.batches = {}
+        # HTTP server and its thread, created when started
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        """Base URL of the API for the client of OpenAI."""
+        return 'http://{}:{}/v1'.format(self.host, self.port)
+
+    def start(self):
+        """Start server in a background thread.
+
+        Returns:
+            StandInServer: the server.
+        """
+        self.httpd = ThreadingHTTPServer((self.host, self.port), StandInHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.standin = self
+        # port chosen by the system
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info('Started stand-in server for OpenAI at {}.', self.url)
+        return self
+
+    def stop(self):
+        """Stop server."""
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
+            self.httpd = self.thread = None
+            logger.info('Stopped stand-in server with counts {}.', self.stats())
+
+    def serve_forever(self):
+        """Run server in the calling thread until interrupted."""
+        self.start()
+        try:
+            self.thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stats(self):
+        """Return counters of requests.
+
+        Returns:
+            dict: counters.
+        """
+        with self.lock:
+            return dict(self.counts)
+
+    def count(self, name, value=1):
+        """Increase counter."""
+        with self.lock:
+            self.counts[name] += value
+
+    def stalls(self):
+        """Decide if a streamed response stalls after the first token.
+
+        Returns:
+            bool: response stalls.
+        """
+        with self.lock:
+            stall = self.random.random() < self.rate_stall
+        if stall:
+            self.count('stall')
+        return stall
+
+    @staticmethod
+    def chunks(body):
+        """Split completion into chunks of a streamed response, one per word.
+        Args:
+            body (dict): completion.
+
+        Yields:
+            dict: chunk.
+        """
+        def chunk(delta, finish_reason=None):
+            return {'id': body['id'],
+                    'object': 'chat.completion.chunk',
+                    'created': body['created'],
+                    'model': body['model'],
+                    'choices': [{'index': 0, 'delta': delta, 'logprobs': None, 'finish_reason': finish_reason}]}
+
+        yield chunk({'role': 'assistant', 'content': ''})
+        content = body['choices'][0]['message']['content']
+        for i, word in enumerate(content.split(' ')):
+            yield chunk({'content': word if i == 0 else ' ' + word})
+        yield chunk({}, 'stop')
+
+    @staticmethod
+    def error(message, error_type, code=None):
+        """Return body of error in the format of OpenAI."""
+        return {'error': {'message': message, 'type': error_type, 'param': None, 'code': code}}
+
+    def cached_tokens(self, messages, prompt_tokens):
+        """Return number of tokens of the prompt served from cache. Like with
+        OpenAI, prompts of at least 1024 tokens are cached, and the prompt
+        without its last part is a hit if it was seen before, e.g. pages of a
+        report asked another query.
+        Args:
+            messages (list): messages of request.
+            prompt_tokens (int): number of tokens of the prompt.
+
+        Returns:
+            int: number of cached tokens.
+        """
+        if not messages or prompt_tokens < 1024:
+            return 0
+        last = messages[-1].get('content')
+        prefix = messages[:-1] + [dict(messages[-1], content=last[:-1] if isinstance(last, list) else '')]
+        key = hashlib.sha256(json.dumps(prefix, sort_keys=True).encode('utf-8')).hexdigest()
+        with self.lock:
+            cached = key in self.prefixes
+            self.prefixes.add(key)
+        if not cached:
+            return 0
+        self.count('cached_tokens', prompt_tokens - 50)
+        return prompt_tokens - 50
+
+    def upload(self, filename, purpose, data):
+        """Store file.
+        Args:
+            filename (str): name of file.
+            purpose (str): purpose of file, e.g. batch.
+            data (bytes): content of file.
+
+        Returns:
+            dict: file object.
+        """
+        file = {'id': 'file-' + uuid.uuid4().hex,
+                'object': 'file',
+                'bytes': len(data),
+                'created_at': int(time.time()),
+                'filename': filename,
+                'purpose': purpose,
+                'status': 'processed'}
+        with self.lock:
+            self.files[file['id']] = file
+            self.contents[file['id']] = data
+        return file
+
+    def file_content(self, file_id):
+        """Return content of file, None if there is no such file."""
+        with self.lock:
+            return self.contents.get(file_id)
+
+    def create_batch(self, request):
+        """Create batch of requests in an uploaded input file and answer them
+        in a background thread.
+        Args:
+            request (dict): body of request.
+
+        Returns:
+            tuple: status code and body of response.
+        """
+        if self.file_content(request.get('input_file_id')) is None:
+            return 400, self.error('No file with id {}.'.format(request.get('input_file_id')),
+                                   'invalid_request_error')
+        now = int(time.time())
+        batch = {'id': 'batch_' + uuid.uuid4().hex,
+                 'object': 'batch',
+                 'endpoint': request.get('endpoint'),
+                 'input_file_id': request['input_file_id'],
+                 'completion_window': request.get('completion_window'),
+                 'status': 'in_progress',
+                 'output_file_id': None,
+                 'error_file_id': None,
+                 'created_at': now,
+                 'in_progress_at': now,
+                 'metadata': request.get('metadata'),
+                 'request_counts': {'total': 0, 'completed': 0, 'failed': 0}}
+        with self.lock:
+            self.batches[batch['id']] = batch
+        threading.Thread(target=self.run_batch, args=(batch['id'],), daemon=True).start()
+        return 200, dict(batch)
+
+    def run_batch(self, batch_id):
+        """Answer requests of batch with complete() and store results as the
+        output file of the batch.
+        Args:
+            batch_id (str): id of batch.
+        """
+        batch = self.batches[batch_id]
+        lines = self.file_content(batch['input_file_id']).decode('utf-8').splitlines()
+        results = []
+        counts = {'total': 0, 'completed': 0, 'failed': 0}
+        for line in lines:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            status, body, _ = self.complete(item.get('body') or {})
+            counts['total'] += 1
+            counts['completed' if status == 200 else 'failed'] += 1
+            results.append({'id': 'batch_req_' + uuid.uuid4().hex,
+                            'custom_id': item.get('custom_id'),
+                            'response': {'status_code': status, 'request_id': body.get('id'), 'body': body},
+                            'error': None})
+        data = ''.join(json.dumps(result) + '\n' for result in results).encode('utf-8')
+        output = self.upload('{}_output.jsonl'.format(batch_id), 'batch_output', data)
+        with self.lock:
+            batch.update(status='completed', output_file_id=output['id'], completed_at=int(time.time()),
+                         request_counts=counts)
+        logger.info('Completed batch {} with {} requests.', batch_id, counts['total'])
+
+    def complete(self, request):
+        """Answer request for chat completion, possibly with a fault.
+        Args:
+            request (dict): body of request.
+
+        Returns:
+            tuple: status code, body and headers of response.
+        """
+        self.count('requests')
+        with self.lock:
+            fault = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        # rate limit exceeded
+        if fault < self.rate_429:
+            self.count('429')
+            return (429, self.error('Rate limit reached.', 'requests', 'rate_limit_exceeded'),
+                    {'retry-after': str(self.retry_after),
+                     'x-ratelimit-remaining-requests': '0',
+                     'x-ratelimit-reset-requests': '{}s'.format(self.retry_after)})
+        fault -= self.rate_429
+        # server error
+        if fault < self.rate_5xx:
+            self.count('5xx')
+            status = 503 if fault < self.rate_5xx / 2 else 500
+            return status, self.error('The server had an error while processing your request.', 'server_error'), {}
+        fault -= self.rate_5xx
+        # request hangs until client times out
+        if fault < self.rate_timeout:
+            self.count('timeout')
+            delay = self.timeout_delay
+        if delay:
+            time.sleep(delay)
+        # count parts of content of messages
+        n_images = n_texts = 0
+        for message in request.get('messages', []):
+            content = message.get('content')
+            if isinstance(content, str):
+                n_texts += 1
+                continue
+            for item in content or []:
+                if item.get('type') == 'image_url':
+                    n_images += 1
+                else:
+                    n_texts += 1
+        request_id = 'chatcmpl-' + uuid.uuid4().hex
+        structured = (request.get('response_format') or {}).get('type') == 'json_schema'
+        template = self.template_json if structured else self.template
+        content = template.format(model=request.get('model'), n_images=n_images, n_texts=n_texts,
+                                  request_id=request_id)
+        # malformed structured response
+        if structured and self.random.random() < self.rate_malformed:
+            self.count('malformed')
+            content = content[:len(content) // 2]
+        self.count('images', n_images)
+        self.count('completed')
+        completion_tokens = len(content) // 4 + 1
+        prompt_tokens = 765 * n_images + 50 * n_texts
+        cached_tokens = self.cached_tokens(request.get('messages', []), prompt_tokens)
+        return 200, {'id': request_id,
+                     'object': 'chat.completion',
+                     'created': int(time.time()),
+                     'model': request.get('model'),
+                     'choices': [{'index': 0,
+                                  'message': {'role': 'assistant', 'content': content},
+                                  'logprobs': None,
+                                  'finish_reason': 'stop'}],
+                     'usage': {'prompt_tokens': prompt_tokens,
+                               'prompt_tokens_details': {'cached_tokens': cached_tokens},
+                               'completion_tokens': completion_tokens,
+                               'total_tokens': prompt_tokens + completion_tokens}}, {}
+
+
+if __name__ == '__main__':
+    gpte.logs(show_level='info', show_color=True)
+    StandInServer(HOST, PORT, latency=LATENCY, jitter=JITTER, rate_429=RATE_429, rate_5xx=RATE_5XX,
+                  rate_timeout=RATE_TIMEOUT, timeout_delay=TIMEOUT_DELAY, token_delay=TOKEN_DELAY,
+                  rate_stall=RATE_STALL, rate_malformed=RATE_MALFORMED).serve_forever()